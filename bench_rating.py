@@ -0,0 +1,176 @@
+# bench_rating.py
+
+"""
+Сравнение парсеров рейтинга (ODS потоковый, ODS через odfpy, XLSX через openpyxl)
+на сгенерированной книге: время разбора и пик памяти (tracemalloc).
+Запуск: python bench_rating.py [--rows 10000] [--extra-sheets 2] [--skip-odfpy]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+from openpyxl import Workbook
+
+import rating
+from rating import RATING_SHEETS
+
+START_ROW = 35
+EXTRA_COLUMNS = 8
+
+_CONTENT_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-content'
+    ' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+    ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+    ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+    ' office:version="1.2"><office:body><office:spreadsheet>'
+)
+_CONTENT_TAIL = '</office:spreadsheet></office:body></office:document-content>'
+_MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '</manifest:manifest>'
+)
+
+
+def _cell(value):
+    if not value:
+        return '<table:table-cell/>'
+    return f'<table:table-cell office:value-type="string"><text:p>{escape(value)}</text:p></table:table-cell>'
+
+
+def _student_rows(rows, seed):
+    """Строки студентов (номер, ФИО, баллы, лишние колонки) - одинаковые для книг ODS и XLSX."""
+    for i in range(1, rows + 1):
+        score = float(f'{(i * 7 + seed) % 100}.{i % 10}')
+        yield i, f'Студент {seed}-{i}', score, [(i + col) % 5 for col in range(EXTRA_COLUMNS)]
+
+
+def _sheet_xml(name, rows, seed):
+    """Лист как в реальной книге: шапка, строки студентов с лишними колонками и повторяющийся пустой хвост."""
+    parts = [
+        f'<table:table table:name="{escape(name)}">',
+        '<table:table-column table:number-columns-repeated="1024"/>',
+    ]
+    empty_row = '<table:table-row><table:table-cell table:number-columns-repeated="1024"/></table:table-row>'
+    parts.extend([empty_row] * (START_ROW - 2))
+    parts.append('<table:table-row>' + ''.join(map(_cell, ('№', 'ФИО', 'Баллы'))) + '</table:table-row>')
+    for number, name, score, extra in _student_rows(rows, seed):
+        parts.append(
+            '<table:table-row>'
+            + _cell(str(number)) + _cell(name) + _cell(str(score).replace('.', ','))
+            + ''.join(_cell(str(value)) for value in extra)
+            + f'<table:table-cell table:number-columns-repeated="{1024 - 3 - EXTRA_COLUMNS}"/>'
+            + '</table:table-row>'
+        )
+    parts.append(_cell('итого').join(('<table:table-row>', '</table:table-row>')))
+    parts.append(
+        '<table:table-row table:number-rows-repeated="1000000">'
+        '<table:table-cell table:number-columns-repeated="1024"/></table:table-row>'
+    )
+    parts.append('</table:table>')
+    return ''.join(parts)
+
+
+def _sheet_names(extra_sheets):
+    """Лист рейтинга первым, за ним посторонние листы того же размера (их парсерам нужно пропустить)."""
+    target = RATING_SHEETS['ЯП']
+    others = [sheet for sheet in RATING_SHEETS.values() if sheet != target]
+    others += [f'Прочее {i}' for i in range(max(0, extra_sheets - len(others)))]
+    return target, [target] + others[:extra_sheets]
+
+
+def make_ods(path, rows, names):
+    """Пишет ODS напрямую в zip."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        # mimetype должен быть первым и несжатым
+        archive.writestr('mimetype', 'application/vnd.oasis.opendocument.spreadsheet', zipfile.ZIP_STORED)
+        archive.writestr('META-INF/manifest.xml', _MANIFEST)
+        with archive.open('content.xml', 'w') as content:
+            content.write(_CONTENT_HEAD.encode())
+            for seed, name in enumerate(names):
+                content.write(_sheet_xml(name, rows, seed).encode())
+            content.write(_CONTENT_TAIL.encode())
+
+
+def make_xlsx(path, rows, names):
+    """
+    Пишет XLSX с теми же данными через openpyxl. Не в режиме write_only: он не записывает
+    размер листа (<dimension>), и openpyxl при чтении пришлось бы просматривать все листы целиком,
+    а Excel и LibreOffice размер записывают.
+    """
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for seed, name in enumerate(names):
+        sheet = workbook.create_sheet(name)
+        sheet.cell(row=START_ROW - 1, column=1, value='№')
+        sheet.cell(row=START_ROW - 1, column=2, value='ФИО')
+        sheet.cell(row=START_ROW - 1, column=3, value='Баллы')
+        for number, student, score, extra in _student_rows(rows, seed):
+            sheet.append([number, student, score, *extra])
+        sheet.append(['итого'])
+    workbook.save(path)
+
+
+def measure(parser, path, sheets):
+    """Время без tracemalloc (он замедляет разбор в разы) и пик памяти отдельным прогоном."""
+    started = time.perf_counter()
+    result = parser(path, sheets, START_ROW)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    parser(path, sheets, START_ROW)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='строк студентов на лист')
+    parser.add_argument('--extra-sheets', type=int, default=2, help='посторонних листов в книге')
+    parser.add_argument('--skip-odfpy', action='store_true', help='не запускать медленный разбор через odfpy')
+    args = parser.parse_args()
+
+    target, names = _sheet_names(args.extra_sheets)
+    paths = {}
+    for spreadsheet_format, make in (('ods', make_ods), ('xlsx', make_xlsx)):
+        fd, paths[spreadsheet_format] = tempfile.mkstemp(suffix=f'.{spreadsheet_format}')
+        os.close(fd)
+        make(paths[spreadsheet_format], args.rows, names)
+        assert rating.detect_spreadsheet_format(paths[spreadsheet_format]) == spreadsheet_format
+        print(f"Книга {spreadsheet_format}: {len(names)} листов по {args.rows} строк, "
+              f"{os.path.getsize(paths[spreadsheet_format]) / 2**20:.1f} МБ")
+
+    backends = [
+        ('ods', 'потоковый', rating.parse_ods_sheets),
+        ('ods', 'odfpy', rating.parse_ods_sheets_odfpy),
+        ('xlsx', 'openpyxl', rating.parse_xlsx_sheets),
+    ]
+    if args.skip_odfpy:
+        backends = [backend for backend in backends if backend[1] != 'odfpy']
+    try:
+        results = {}
+        for spreadsheet_format, label, parse in backends:
+            label = f'{spreadsheet_format} {label}'
+            result, elapsed, peak = measure(parse, paths[spreadsheet_format], [target])
+            results[label] = result
+            rows = sum(map(len, result.values()))
+            print(f"{label:>15}: {elapsed:8.2f} с, пик памяти {peak / 2**20:8.1f} МБ, строк {rows}")
+
+        first = next(iter(results.values()))
+        assert all(result == first for result in results.values()), "Парсеры вернули разные данные"
+        print("Результаты совпадают")
+    finally:
+        for path in paths.values():
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# check_journal.py
+
+"""
+Проверка журнала PickleJournalStorage с повреждённым хвостом: в конец журнала дописывается
+обрывок записи (на каждой возможной длине), затем загрузка, новые записи и повторная загрузка.
+Новые записи должны пережить перезапуск, а обрывок - исчезнуть.
+Файлы создаются во временном каталоге.
+Запуск: python check_journal.py
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+
+from storage import PickleJournalStorage
+
+
+def check_torn_tail(directory, torn_length):
+    data_file = os.path.join(directory, f'data_{torn_length}.db')
+    journal_file = os.path.join(directory, f'data_{torn_length}.journal')
+    first = ("register", (1, "Студент 1"))
+    new_records = [("register", (2, "Студент 2")), ("register", (3, "Студент 3")), ("join", (2, "ЯП", None))]
+
+    storage = PickleJournalStorage(data_file, journal_file)
+    storage.save_snapshot({}, {})
+    storage.append([first])
+    # Процесс упал посреди записи: в журнале осталась часть следующей записи
+    torn = pickle.dumps(("register", (4, "Студент 4")))[:torn_length]
+    with open(journal_file, 'ab') as f:
+        f.write(torn)
+
+    # Перезапуск: загрузка останавливается на обрывке, затем приходят новые изменения
+    storage = PickleJournalStorage(data_file, journal_file)
+    _, _, records = storage.load()
+    assert records == [first], f"обрывок длиной {torn_length}: загружено {records}"
+    storage.append(new_records)
+
+    # Ещё один перезапуск: новые записи не должны потеряться за обрывком
+    storage = PickleJournalStorage(data_file, journal_file)
+    _, _, records = storage.load()
+    assert records == [first] + new_records, f"обрывок длиной {torn_length}: после перезапуска загружено {records}"
+    assert storage.journal_size == len(records)
+
+
+def main():
+    # Предупреждения о повреждённом хвосте здесь ожидаемы
+    logging.getLogger('storage').setLevel(logging.ERROR)
+    record_length = len(pickle.dumps(("register", (4, "Студент 4"))))
+    with tempfile.TemporaryDirectory() as directory:
+        for torn_length in range(1, record_length):
+            check_torn_tail(directory, torn_length)
+    print(f"Повреждённый хвост журнала обрезается: проверено {record_length - 1} длин обрывка, новые записи сохраняются")
+
+
+if __name__ == '__main__':
+    main()
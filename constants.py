@@ -6,4 +6,50 @@ BOT_TOKEN = os.getenv("BOT_TOKEN") # Значение по умолчанию д
 # Названия предметов (для очередей)
 SUBJECTS = ["ЯП", "Физика", "Информатика"]
 
-DATA_FILE = "bot_data.db"
\ No newline at end of file
+DATA_FILE = "bot_data.db"
+
+# Журнал операций: изменения дописываются сюда и периодически сворачиваются в DATA_FILE
+JOURNAL_FILE = "bot_data.journal"
+JOURNAL_COMPACT_THRESHOLD = 500
+
+# Хранилище данных: "pickle" (снимок DATA_FILE + журнал) или "sqlite" (SQLITE_FILE)
+# При первом запуске с "sqlite" данные переносятся из DATA_FILE автоматически
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "pickle")
+SQLITE_FILE = "bot_data.sqlite3"
+
+# Интервал фоновой записи изменений на диск (секунды)
+PERSIST_INTERVAL = 1.0
+
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя - по очереди)
+MAX_CONCURRENT_UPDATES = 64
+
+# Сколько последних отредактированных сообщений помнить, чтобы не повторять одинаковые правки
+EDIT_CACHE_SIZE = 2048
+
+# Отображение длинных очередей: размер страницы, сколько первых мест и соседей показывать в окне
+QUEUE_PAGE_SIZE = 30
+QUEUE_TOP_SIZE = 5
+QUEUE_NEIGHBOURHOOD = 3
+
+# Максимальная длина одной страницы содержимого базы в меню разработчика (лимит Telegram - 4096)
+DB_PAGE_CHARS = 3500
+
+# Сколько пользователей показывать на одной странице выбора в меню разработчика
+PICKER_PAGE_SIZE = 10
+
+# Уведомления о сдвиге места в очереди: окно объединения изменений (секунды),
+# сколько первых мест уведомлять и сколько сообщений отправлять одновременно
+NOTIFY_COALESCE_WINDOW = 3.0
+NOTIFY_NEXT_K = 3
+NOTIFY_MAX_CONCURRENT = 8
+
+# Очередь отправки (лимиты Bot API): запросов в секунду всего, запросов в секунду на чат,
+# сколько запросов в чат можно отправить подряд, повторов после 429, одновременных запросов
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1.0
+SEND_CHAT_BURST = 3
+SEND_MAX_RETRIES = 3
+SEND_MAX_IN_FLIGHT = 16
+
+# Как часто писать в лог метрики очереди отправки (секунды)
+SEND_METRICS_INTERVAL = 60
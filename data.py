@@ -1,6 +1,11 @@
-import pickle
+import asyncio
+import bisect
 import logging
-from constants import SUBJECTS, DATA_FILE
+from constants import SUBJECTS, STORAGE_BACKEND
+from storage import create_storage
+from persistence import BackgroundWriter
+from queue_store import QueueStore
+from outbox import send_message
 from telegram.ext import Application
 
 application = None
@@ -11,52 +16,300 @@ logger = logging.getLogger(__name__)
 
 
 # --- Хранилище данных ---
-# Словарь для хранения пользователей: ID -> {"name": "Имя", "banned": False}
+# Словарь для хранения пользователей: ID -> {"name": "Имя", "banned": False, "notify": False}
 user_names = {}
-# Очередь в виде словаря для каждого предмета
-queues = {subject: [] for subject in SUBJECTS}
+# Очередь для каждого предмета: QueueStore с ID пользователей.
+# Имена берутся из user_names только при отображении.
+queues = {subject: QueueStore() for subject in SUBJECTS}
+
+# --- Индексы, поддерживаемые функциями _apply_* ---
+# Нормализованное имя -> множество ID пользователей с таким именем
+name_index = {}
+# ID пользователя -> множество предметов, в очередях которых он стоит
+user_subjects = {}
+# ID забаненных пользователей. frozenset заменяется целиком при бане/разбане,
+# поэтому читать его всегда нужно через data.banned_ids или is_user_banned()
+banned_ids = frozenset()
+# Отсортированные пары (нормализованное имя, ID) для постраничного выбора и поиска по префиксу:
+# "all" - все пользователи, "active" - незабаненные, "banned" - забаненные
+name_orders = {"all": [], "active": [], "banned": []}
+# ID пользователей, включивших уведомления о сдвиге места в очереди
+notify_ids = set()
+
+# Функции listener(subjects), которые вызываются после каждого изменения очередей
+# (кроме проигрывания журнала при старте); subjects - множество изменённых предметов
+queue_listeners = []
+
+# --- Блокировки очередей ---
+# Апдейты обрабатываются параллельно (см. update_processor.py). Сами изменения в памяти
+# синхронны и поэтому атомарны для event loop; лок предмета сериализует обработчики,
+# которые проверяют состояние очереди и затем меняют её.
+_queue_locks = {subject: asyncio.Lock() for subject in SUBJECTS}
+
+def queue_lock(subject):
+    """Возвращает asyncio.Lock очереди предмета."""
+    return _queue_locks.setdefault(subject, asyncio.Lock())
+
+def normalize_name(name):
+    """Приводит имя к виду для поиска: регистр, ё/е и лишние пробелы не важны."""
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+def _index_name(user_id, name):
+    key = normalize_name(name)
+    name_index.setdefault(key, set()).add(user_id)
+    bisect.insort(name_orders["all"], (key, user_id))
+    bisect.insort(name_orders["banned" if user_id in banned_ids else "active"], (key, user_id))
+
+def _order_remove(scope, key, user_id):
+    order = name_orders[scope]
+    i = bisect.bisect_left(order, (key, user_id))
+    if i < len(order) and order[i] == (key, user_id):
+        del order[i]
+
+def _unindex_name(user_id, name):
+    key = normalize_name(name)
+    ids = name_index.get(key)
+    if ids is not None:
+        ids.discard(user_id)
+        if not ids:
+            del name_index[key]
+    _order_remove("all", key, user_id)
+    _order_remove("banned" if user_id in banned_ids else "active", key, user_id)
+
+def _rebuild_indexes():
+    global banned_ids
+    name_index.clear()
+    user_subjects.clear()
+    banned_ids = frozenset(uid for uid, data in user_names.items() if data.get("banned", False))
+    for order in name_orders.values():
+        order.clear()
+    for uid, data in user_names.items():
+        key = normalize_name(data["name"])
+        name_index.setdefault(key, set()).add(uid)
+        name_orders["all"].append((key, uid))
+        name_orders["banned" if uid in banned_ids else "active"].append((key, uid))
+    for order in name_orders.values():
+        order.sort()
+    notify_ids.clear()
+    notify_ids.update(uid for uid, data in user_names.items() if data.get("notify", False))
+    for subject, queue in queues.items():
+        for uid in queue:
+            user_subjects.setdefault(uid, set()).add(subject)
+
+def _snapshot_state():
+    """Копия данных для записи снимка вне event loop."""
+    return (
+        {uid: dict(data) for uid, data in user_names.items()},
+        {subject: list(queue) for subject, queue in queues.items()},
+    )
+
+# Хранилище выбирается в constants.STORAGE_BACKEND (см. storage.py)
+_storage = create_storage()
+# Изменения сохраняются фоновым воркером пачками (см. persistence.py)
+_writer = BackgroundWriter(_storage, _snapshot_state)
 
 def save_data_to_file():
-    """Сохраняет данные в бинарный .db файл."""
-    data_to_save = {
-        'user_names': user_names,
-        'queues': queues,
-    }
+    """
+    Сохраняет полный снимок данных в хранилище.
+    Вызывается при миграции и для редких массовых изменений.
+    """
     try:
-        with open(DATA_FILE, 'wb') as f:
-            pickle.dump(data_to_save, f)
-        logger.info(f"Данные успешно сохранены в {DATA_FILE}")
+        _writer.request_snapshot()
+        logger.info(f"Снимок данных поставлен на сохранение ({STORAGE_BACKEND})")
     except Exception as e:
-        logger.error(f"Ошибка при сохранении данных в файл {DATA_FILE}: {e}")
+        logger.error(f"Ошибка при сохранении снимка данных ({STORAGE_BACKEND}): {e}")
+
+async def start_persistence(app_instance=None):
+    """Запускает фоновую запись данных (вызывается из post_init приложения)."""
+    await _writer.start()
+
+async def stop_persistence(app_instance=None):
+    """Сохраняет все накопленные изменения и останавливает фоновую запись."""
+    await _writer.stop()
+
+async def flush_data():
+    """Дожидается сохранения всех изменений, сделанных до вызова."""
+    await _writer.flush()
 
 def load_data_from_file():
-    """Загружает данные из бинарного .db файла."""
-    global user_names, queues
+    """Загружает снимок данных из хранилища и проигрывает поверх него журнал операций."""
     try:
-        with open(DATA_FILE, 'rb') as f:
-            loaded_data = pickle.load(f)
-        # Обновляем словари
-        loaded_users = loaded_data.get('user_names', {})
-        # Конвертируем старый формат если нужно
-        for uid, data in loaded_users.items():
-            if isinstance(data, str):
-                user_names[uid] = {"name": data, "banned": False}
-            else:
-                user_names[uid] = data
-        
-        queues.update(loaded_data.get('queues', {subject: [] for subject in SUBJECTS}))
-        logger.info(f"Данные успешно загружены из {DATA_FILE}")
-    except FileNotFoundError:
-        logger.info(f"Файл {DATA_FILE} не найден. Используем начальные значения.")
+        loaded_users, loaded_queues, records = _storage.load()
+    except Exception as e:
+        logger.error(f"Неизвестная ошибка при загрузке данных ({STORAGE_BACKEND}): {e}")
+        return
+
+    # Конвертируем старый формат если нужно
+    for uid, data in loaded_users.items():
+        if isinstance(data, str):
+            user_names[uid] = {"name": data, "banned": False}
+        else:
+            user_names[uid] = data
+    for subject, loaded_queue in loaded_queues.items():
+        queues[subject] = QueueStore(_queue_user_ids(loaded_queue, subject))
+
+    _rebuild_indexes()
+    for op, args in records:
+        try:
+            _OPERATIONS[op](*args)
+        except Exception as e:
+            logger.warning(f"Не удалось применить операцию '{op}' {args} из журнала: {e}")
+    if records:
+        logger.info(f"Из журнала применено {len(records)} операций.")
+
+    if _storage.needs_snapshot():
         save_data_to_file()
+
+def _queue_user_ids(loaded_queue, subject):
+    """Возвращает ID из загруженной очереди; старый формат хранил в очередях имена."""
+    name_to_id = None
+    user_ids = []
+    for entry in loaded_queue:
+        if isinstance(entry, str):
+            if name_to_id is None:
+                name_to_id = {}
+                for uid, data in user_names.items():
+                    name_to_id.setdefault(data["name"], uid)
+            if entry not in name_to_id:
+                logger.warning(f"Имя '{entry}' из очереди '{subject}' не найдено среди пользователей, запись пропущена.")
+                continue
+            entry = name_to_id[entry]
+        if entry not in user_ids:
+            user_ids.append(entry)
+    return user_ids
+
+# --- Журнал операций ---
+# Каждое изменение - это запись (op, args): она применяется к данным в памяти
+# и передаётся хранилищу, которое сохраняет только её, а не все данные целиком.
+# Те же функции _apply_* проигрывают журнал при старте.
+
+def _apply_register(user_id, name):
+    if user_id in user_names:
+        _unindex_name(user_id, user_names[user_id]["name"])
+        user_names[user_id]["name"] = name
+    else:
+        user_names[user_id] = {"name": name, "banned": False}
+    _index_name(user_id, name)
+    # Имя отображается в очередях - их отрисовку нужно обновить (и для ID, который стоял
+    # в очереди до регистрации и показывался как "Неизвестный")
+    for subject in user_subjects.get(user_id, ()):
+        queues[subject].touch()
+
+def _leave_all_queues(user_id):
+    for subject in user_subjects.pop(user_id, ()):
+        queues[subject].discard(user_id)
+
+def _apply_forget(user_id):
+    global banned_ids
+    data = user_names.pop(user_id, None)
+    if data is None:
+        return
+    _unindex_name(user_id, data["name"])
+    if user_id in banned_ids:
+        banned_ids = banned_ids - {user_id}
+    notify_ids.discard(user_id)
+    _leave_all_queues(user_id)
+
+def _apply_join(user_id, subject, position):
+    queue = queues[subject]
+    queue.discard(user_id)
+    if position is not None and 0 <= position <= len(queue):
+        queue.insert(position, user_id)
+    else:
+        queue.append(user_id)
+    user_subjects.setdefault(user_id, set()).add(subject)
+
+def _apply_leave(user_id, subject):
+    queues[subject].discard(user_id)
+    subjects = user_subjects.get(user_id)
+    if subjects is not None:
+        subjects.discard(subject)
+        if not subjects:
+            del user_subjects[user_id]
+
+def _apply_move(user_id, subject, position):
+    queues[subject].move(user_id, position)
+
+def _apply_ban(user_id):
+    global banned_ids
+    if user_id not in banned_ids:
+        _unindex_name(user_id, user_names[user_id]["name"])
+        banned_ids = banned_ids | {user_id}
+        _index_name(user_id, user_names[user_id]["name"])
+    user_names[user_id]["banned"] = True
+    _leave_all_queues(user_id)
+
+def _apply_unban(user_id):
+    global banned_ids
+    if user_id in banned_ids:
+        _unindex_name(user_id, user_names[user_id]["name"])
+        banned_ids = banned_ids - {user_id}
+        _index_name(user_id, user_names[user_id]["name"])
+    user_names[user_id]["banned"] = False
+
+def _apply_notify(user_id, enabled):
+    user_names[user_id]["notify"] = enabled
+    if enabled:
+        notify_ids.add(user_id)
+    else:
+        notify_ids.discard(user_id)
+
+_OPERATIONS = {
+    "register": _apply_register,
+    "forget": _apply_forget,
+    "join": _apply_join,
+    "leave": _apply_leave,
+    "move": _apply_move,
+    "ban": _apply_ban,
+    "unban": _apply_unban,
+    "notify": _apply_notify,
+}
+
+def _changed_subjects(op, args):
+    """Очереди, которые изменит операция (вычисляется до её применения)."""
+    if op in ("join", "leave", "move"):
+        return {args[1]}
+    if op in ("forget", "ban"):
+        return set(user_subjects.get(args[0], ()))
+    return set()
+
+def _commit(op, *args):
+    """Применяет операцию к данным в памяти и ставит её в очередь на сохранение."""
+    subjects = _changed_subjects(op, args)
+    _OPERATIONS[op](*args)
+    if subjects:
+        for listener in queue_listeners:
+            try:
+                listener(subjects)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения очередей {listener.__name__}: {e}")
+    try:
+        _writer.submit((op, args))
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при загрузке данных из файла {DATA_FILE}: {e}")
+        logger.error(f"Ошибка при сохранении операции '{op}' ({STORAGE_BACKEND}): {e}")
+        # Без журнала изменение можно сохранить только полным снимком
         save_data_to_file()
 
 # Загружаем данные при импорте модуля
 load_data_from_file()
 
 # --- Функции для работы с данными ---
+def register_user(user_id, name):
+    """Регистрирует пользователя или меняет имя уже зарегистрированного."""
+    _commit("register", user_id, name)
+    logger.info(f"register_user: Пользователь {user_id} сохранён под именем '{name}'.")
+    return True
+
+def forget_user(user_id):
+    """Удаляет пользователя из базы данных и из всех очередей."""
+    if user_id not in user_names:
+        logger.warning(f"forget_user: Пользователь {user_id} не найден.")
+        return False
+    name = user_names[user_id]["name"]
+    _commit("forget", user_id)
+    logger.info(f"forget_user: Пользователь '{name}' (ID {user_id}) удалён из базы данных и из всех очередей.")
+    return True
+
 def add_user_to_queue(user_id, subject, position=None):
     """
     Добавляет пользователя в очередь на определённую позицию.
@@ -73,19 +326,12 @@ def add_user_to_queue(user_id, subject, position=None):
         logger.warning(f"add_user_to_queue: Предмет '{subject}' не найден.")
         return False
 
-    if name in queues[subject]:
-        old_position = queues[subject].index(name)
-        queues[subject].remove(name)
-        logger.info(f"add_user_to_queue: Пользователь '{name}' (ID {user_id}) удален из очереди '{subject}' с позиции {old_position} перед добавлением.")
+    if user_id in queues[subject]:
+        old_position = queues[subject].index(user_id)
+        logger.info(f"add_user_to_queue: Пользователь '{name}' (ID {user_id}) будет перенесён в очереди '{subject}' с позиции {old_position}.")
 
-    if position is not None and 0 <= position <= len(queues[subject]):
-        queues[subject].insert(position, name)
-        logger.info(f"add_user_to_queue: Пользователь '{name}' (ID {user_id}) добавлен в очередь '{subject}' на позицию {position}.")
-    else:
-        queues[subject].append(name)
-        logger.info(f"add_user_to_queue: Пользователь '{name}' (ID {user_id}) добавлен в конец очереди '{subject}'.")
-
-    save_data_to_file()
+    _commit("join", user_id, subject, position)
+    logger.info(f"add_user_to_queue: Пользователь '{name}' (ID {user_id}) добавлен в очередь '{subject}' на позицию {queues[subject].index(user_id)}.")
     return True
 
 def remove_user_from_queue(user_id, subject):
@@ -99,9 +345,8 @@ def remove_user_from_queue(user_id, subject):
         return False
     
     name = user_names[user_id]["name"]
-    if name and name in queues[subject]:
-        queues[subject].remove(name)
-        save_data_to_file()
+    if user_id in queues[subject]:
+        _commit("leave", user_id, subject)
         logger.info(f"remove_user_from_queue: Пользователь '{name}' (ID {user_id}) удален из очереди '{subject}'.")
         return True
     else:
@@ -120,7 +365,7 @@ def move_user_in_queue(user_id, subject, new_position):
         return False
     
     name = user_names[user_id]["name"]
-    if subject not in queues or name not in queues[subject]:
+    if subject not in queues or user_id not in queues[subject]:
         logger.warning(f"move_user_in_queue: Пользователь '{name}' не в очереди '{subject}'.")
         return False
 
@@ -128,18 +373,53 @@ def move_user_in_queue(user_id, subject, new_position):
         logger.warning(f"move_user_in_queue: Некорректная позиция {new_position} для очереди '{subject}'.")
         return False
 
-    old_position = queues[subject].index(name)
-    queues[subject].remove(name)
-    queues[subject].insert(new_position, name)
-    save_data_to_file()
+    old_position = queues[subject].index(user_id)
+    _commit("move", user_id, subject, new_position)
     logger.info(f"move_user_in_queue: Пользователь '{name}' (ID {user_id}) перемещен в очереди '{subject}' с позиции {old_position} на позицию {new_position}.")
     return True
 
+def remove_unknown_from_queues():
+    """Удаляет из всех очередей ID, которых нет в user_names. Возвращает число удалённых записей."""
+    removed = 0
+    # user_subjects содержит только тех, кто стоит хотя бы в одной очереди
+    unknown_ids = [uid for uid in user_subjects if uid not in user_names]
+    for uid in unknown_ids:
+        for subject in list(user_subjects[uid]):
+            _commit("leave", uid, subject)
+            logger.info(f"remove_unknown_from_queues: Неизвестный ID {uid} удалён из очереди '{subject}'.")
+            removed += 1
+    return removed
+
+def find_users_by_name(name):
+    """Возвращает множество ID пользователей с таким именем (без учёта регистра и ё/е)."""
+    return set(name_index.get(normalize_name(name), ()))
+
+def find_users_by_prefix(prefix, scope="all", offset=0, limit=None):
+    """
+    Ищет пользователей, чьё имя начинается с prefix (без учёта регистра и ё/е).
+    scope - "all", "active" или "banned". Возвращает (ID с offset по offset+limit по алфавиту, число найденных)
+    за O(log n + limit) благодаря отсортированному name_orders.
+    """
+    order = name_orders[scope]
+    key = normalize_name(prefix)
+    lo = bisect.bisect_left(order, (key,))
+    hi = bisect.bisect_left(order, (key + "\U0010ffff",)) if key else len(order)
+    start = lo + offset
+    stop = hi if limit is None else min(hi, start + limit)
+    return [uid for _, uid in order[start:stop]], hi - lo
+
+def get_user_subjects(user_id):
+    """Возвращает множество предметов, в очередях которых стоит пользователь."""
+    return set(user_subjects.get(user_id, ()))
+
+def get_user_display_name(user_id):
+    """Имя пользователя для отображения в очередях."""
+    data = user_names.get(user_id)
+    return data["name"] if data else f"Неизвестный ({user_id})"
+
 def is_user_banned(user_id):
     """Проверяет, забанен ли пользователь."""
-    if user_id not in user_names:
-        return False
-    return user_names[user_id].get("banned", False)
+    return user_id in banned_ids
 
 async def ban_user(user_id, app_instance=None): # <-- ДОБАВИТЬ app_instance
     """Добавляет пользователя в бан."""
@@ -155,23 +435,20 @@ async def ban_user(user_id, app_instance=None): # <-- ДОБАВИТЬ app_insta
         logger.info(f"ban_user: Пользователь {user_id} уже забанен.")
         return False
     
-    user_names[user_id]["banned"] = True
     user_name = user_names[user_id]["name"]
-    
-    # Удаляем пользователя из всех очередей
-    for subject in queues:
-        if user_name in queues[subject]:
-            queues[subject].remove(user_name)
-    
-    save_data_to_file()
+    # Бан также удаляет пользователя из всех очередей
+    _commit("ban", user_id)
+    # Бан должен пережить перезапуск - дожидаемся записи на диск
+    await flush_data()
     logger.info(f"ban_user: Пользователь {user_id} ({user_name}) забанен.")
     
     # --- ОТПРАВКА УВЕДОМЛЕНИЯ ЗАБАНЕННОМУ ПОЛЬЗОВАТЕЛЮ ---
     if application:
         try:
-            await application.bot.send_message(
-                chat_id=user_id,
-                text="❌ Вы забанены и не можете больше использовать этого бота."
+            await send_message(
+                application.bot,
+                user_id,
+                "❌ Вы забанены и не можете больше использовать этого бота."
             )
             logger.info(f"ban_user: Уведомление о бане отправлено пользователю {user_id}.")
         except Exception as e:
@@ -189,16 +466,17 @@ async def unban_user(user_id, app_instance=None):
         logger.info(f"unban_user: Пользователь {user_id} не найден в user_names.")
         return False
 
-    user_names[user_id]["banned"] = False
-    save_data_to_file()
+    _commit("unban", user_id)
+    await flush_data()
     logger.info(f"unban_user: Пользователь {user_id} разбанен.")
 
     # --- ОТПРАВКА УВЕДОМЛЕНИЯ РАЗБАНЕННОМУ ПОЛЬЗОВАТЕЛЮ (опционально) ---
     if application:
         try:
-            await application.bot.send_message(
-                chat_id=user_id,
-                text="✅ Вы разбанены и можете снова использовать бота."
+            await send_message(
+                application.bot,
+                user_id,
+                "✅ Вы разбанены и можете снова использовать бота."
             )
             logger.info(f"unban_user: Уведомление о разбане отправлено пользователю {user_id}.")
         except Exception as e:
@@ -207,6 +485,20 @@ async def unban_user(user_id, app_instance=None):
     return True
 
 
+def set_user_notify(user_id, enabled):
+    """Включает или выключает уведомления пользователя о сдвиге места в очереди."""
+    if user_id not in user_names:
+        logger.warning(f"set_user_notify: Пользователь {user_id} не найден.")
+        return False
+    _commit("notify", user_id, enabled)
+    logger.info(f"set_user_notify: Уведомления пользователя {user_id} {'включены' if enabled else 'выключены'}.")
+    return True
+
+def is_user_notified(user_id):
+    """Включены ли у пользователя уведомления о сдвиге места в очереди."""
+    return user_id in notify_ids
+
 def get_all_banned_users():
     """Возвращает словарь всех забаненных пользователей."""
-    return {uid: data for uid, data in user_names.items() if data.get("banned", False)}
+    # Обходим только забаненных, а не всех пользователей
+    return {uid: user_names[uid] for uid in banned_ids}
@@ -1,11 +1,14 @@
 # dev_handlers.py
 
+import asyncio
 import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from constants import SUBJECTS
-from data import user_names, queues, remove_user_from_queue, is_user_banned, ban_user, unban_user, get_all_banned_users
-from rating import update_rating, format_rating_message
+from constants import SUBJECTS, DB_PAGE_CHARS, PICKER_PAGE_SIZE
+from data import user_names, queues, queue_lock, add_user_to_queue, remove_user_from_queue, remove_unknown_from_queues, forget_user, get_user_display_name, ban_user, unban_user, get_all_banned_users, find_users_by_prefix
+from editing import edit_message
+from outbox import scheduler, PRIORITY_INTERACTIVE
+from rating import refresh_ratings, cancel_rating_refresh, get_last_rating_deltas, format_rating_delta, format_rating_message
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +26,129 @@ selected_user_for_add = {}
 # --- Переменные для бана ---
 awaiting_ban_user_selection = set()
 awaiting_unban_user_selection = set()
+# ID разработчика -> фоновая задача, показывающая ему ход обновления рейтинга.
+# Само обновление одно на всех (rating.refresh_ratings), задачи лишь ждут его
+rating_refresh_tasks = {}
+# --- Постраничный выбор пользователя с поиском по имени ---
+# ID разработчика -> {"kind": вид выбора, "prefix": строка поиска}
+user_pickers = {}
+awaiting_picker_search = set()
 
 DEV_CODE = '2411'
 
+# Неизменяемые клавиатуры меню разработчика создаём один раз
+DEV_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("База данных", callback_data='dev_show_db')],
+    [InlineKeyboardButton("📊 Обновить рейтинг", callback_data='dev_update_rating')],
+    [InlineKeyboardButton("Убрать из очереди", callback_data='dev_remove_user_start')],
+    [InlineKeyboardButton("Забыть пользователя", callback_data='dev_forget_user_start')],
+    [InlineKeyboardButton("Добавить в очередь", callback_data='dev_add_user_start')],
+    [InlineKeyboardButton("Очистить очереди от неизвестных", callback_data='dev_clean_unknown')],
+    [InlineKeyboardButton("🚫 Забанить", callback_data='dev_ban_user_start')],
+    [InlineKeyboardButton("✅ Разбанить", callback_data='dev_unban_user_start')],
+    [InlineKeyboardButton("Банлист", callback_data='dev_show_ban_list')],
+    [InlineKeyboardButton("← Назад", callback_data='dev_back_to_user_menu')],
+])
+DEV_BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("← Назад", callback_data='dev_menu')]])
+RATING_CANCEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Отменить", callback_data='dev_cancel_rating')]])
+
+# Вид выбора пользователя -> (область поиска, префикс callback выбора, callback кнопки "Назад", заголовок)
+USER_PICKERS = {
+    'forget': ('all', 'dev_confirm_forget_user_', 'dev_menu', "Выберите пользователя, которого нужно 'забыть' (удалить из базы данных):"),
+    'add': ('all', 'dev_select_user_add_', 'dev_add_user_start', "Выберите пользователя для добавления в очередь '{subject}':"),
+    'ban': ('active', 'dev_select_ban_user_', 'dev_menu', "Выберите пользователя для бана:"),
+    'unban': ('banned', 'dev_confirm_unban_user_', 'dev_menu', "Выберите пользователя для разбана:"),
+}
+
+def _page_nav(page, page_count, callback_prefix):
+    """Ряд кнопок листания страниц: ◀, номер страницы, ▶."""
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀", callback_data=f'{callback_prefix}{page - 1}'))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{page_count}", callback_data=f'{callback_prefix}{page}'))
+    if page < page_count - 1:
+        nav.append(InlineKeyboardButton("▶", callback_data=f'{callback_prefix}{page + 1}'))
+    return nav
+
+def _start_user_picker(user_id, kind):
+    user_pickers[user_id] = {"kind": kind, "prefix": ""}
+    awaiting_picker_search.discard(user_id)
+
+def _render_user_picker(user_id, page=0):
+    """
+    Текст и клавиатура страницы выбора пользователя.
+    Страница строится через find_users_by_prefix за O(log n + PICKER_PAGE_SIZE).
+    """
+    picker = user_pickers[user_id]
+    scope, select_prefix, back_data, title = USER_PICKERS[picker["kind"]]
+    prefix = picker["prefix"]
+
+    _, total = find_users_by_prefix(prefix, scope, 0, 0)
+    page_count = max(1, -(-total // PICKER_PAGE_SIZE))
+    page = min(max(page, 0), page_count - 1)
+    page_ids, _ = find_users_by_prefix(prefix, scope, page * PICKER_PAGE_SIZE, PICKER_PAGE_SIZE)
+
+    text = title.format(subject=selected_subject_for_add.get(user_id, ''))
+    if prefix:
+        text += f"\nПоиск: «{prefix}», найдено: {total}"
+    if not total:
+        text += "\nНикого не найдено."
+
+    keyboard = [
+        [InlineKeyboardButton(f"{user_names[uid]['name']} (ID: {uid})", callback_data=f'{select_prefix}{uid}')]
+        for uid in page_ids
+    ]
+    if page_count > 1:
+        keyboard.append(_page_nav(page, page_count, 'dev_picker_page_'))
+    search_row = [InlineKeyboardButton("🔍 Поиск по имени", callback_data='dev_picker_search')]
+    if prefix:
+        search_row.append(InlineKeyboardButton("✖ Сбросить", callback_data='dev_picker_reset'))
+    keyboard.append(search_row)
+    keyboard.append([InlineKeyboardButton("← Назад", callback_data=back_data)])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def handle_user_picker_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание страниц, запрос и сброс поиска в выборе пользователя."""
+    user_id = update.effective_user.id
+    query = update.callback_query
+    await query.answer()
+
+    if user_id not in user_pickers:
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
+        await show_dev_menu(update, context)
+        return
+
+    if query.data == 'dev_picker_search':
+        awaiting_picker_search.add(user_id)
+        logger.info(f"[DEV_PICKER] Пользователь {user_id} ищет пользователя по имени.")
+        await edit_message(query, "Введите начало имени пользователя:", reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("← Назад", callback_data='dev_picker_page_0')]]
+        ))
+        return
+
+    page = 0
+    if query.data == 'dev_picker_reset':
+        user_pickers[user_id]["prefix"] = ""
+    else:
+        page = int(query.data.split('dev_picker_page_')[1])
+    awaiting_picker_search.discard(user_id)
+    text, reply_markup = _render_user_picker(user_id, page)
+    await edit_message(query, text, reply_markup=reply_markup)
+
+async def handle_picker_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Принимает введённое начало имени. Возвращает True, если сообщение было поисковым запросом."""
+    user_id = update.effective_user.id
+    if user_id not in awaiting_picker_search or user_id not in user_pickers:
+        return False
+    awaiting_picker_search.discard(user_id)
+    user_pickers[user_id]["prefix"] = update.message.text.strip()
+    logger.info(f"[DEV_PICKER] Пользователь {user_id} ищет по префиксу '{user_pickers[user_id]['prefix']}'.")
+    text, reply_markup = _render_user_picker(user_id)
+    await scheduler.submit(
+        user_id, lambda: update.message.reply_text(text, reply_markup=reply_markup), PRIORITY_INTERACTIVE
+    )
+    return True
+
 async def enter_dev_code(update, context):
     """Функция для обработки ввода кода разработчика."""
     user_id = update.effective_user.id
@@ -45,62 +168,79 @@ async def show_dev_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     """Показывает главное меню для разработчика."""
     user_id = update.effective_user.id
     logger.info(f"[DEV_MENU] Показываем меню разработчика пользователю {user_id}")
-    keyboard = [
-        [InlineKeyboardButton("База данных", callback_data='dev_show_db')],
-        [InlineKeyboardButton("📊 Обновить рейтинг", callback_data='dev_update_rating')],
-        [InlineKeyboardButton("Убрать из очереди", callback_data='dev_remove_user_start')],
-        [InlineKeyboardButton("Забыть пользователя", callback_data='dev_forget_user_start')],
-        [InlineKeyboardButton("Добавить в очередь", callback_data='dev_add_user_start')],
-        [InlineKeyboardButton("Очистить очереди от неизвестных", callback_data='dev_clean_unknown')],
-        [InlineKeyboardButton("🚫 Забанить", callback_data='dev_ban_user_start')],
-        [InlineKeyboardButton("✅ Разбанить", callback_data='dev_unban_user_start')],
-        [InlineKeyboardButton("Банлист", callback_data='dev_show_ban_list')],
-        [InlineKeyboardButton("← Назад", callback_data='dev_back_to_user_menu')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = DEV_MENU_MARKUP
 
     if hasattr(update, 'callback_query') and update.callback_query:
         query = update.callback_query
         await query.answer()
-        await query.edit_message_text("Меню разработчика:", reply_markup=reply_markup)
+        await edit_message(query, "Меню разработчика:", reply_markup=reply_markup)
     else:
-        await update.message.reply_text("Меню разработчика:", reply_markup=reply_markup)
-
-async def show_database_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет содержимое базы данных (user_names и queues)."""
-    user_id = update.effective_user.id
-    logger.info(f"[DEV_SHOW_DB] Пользователь {user_id} запросил содержимое базы данных через кнопку.")
+        await scheduler.submit(
+            user_id, lambda: update.message.reply_text("Меню разработчика:", reply_markup=reply_markup), PRIORITY_INTERACTIVE
+        )
 
-    message = "Содержимое базы данных:\n\n"
-    message += "<b>Пользователи:</b>\n"
+def _database_lines():
+    """Строки содержимого базы данных; каждая строка целиком влезает в одну страницу."""
+    lines = ["<b>Пользователи:</b>"]
     if user_names:
         for uid, data in user_names.items():
             ban_status = "🚫 ЗАБАНЕН" if data.get("banned", False) else "✅"
-            message += f"  {ban_status} ID: {uid}, Имя: {data['name']}\n"
+            lines.append(f"  {ban_status} ID: {uid}, Имя: {data['name']}")
     else:
-        message += "  Нет зарегистрированных пользователей.\n"
+        lines.append("  Нет зарегистрированных пользователей.")
 
-    message += "\n<b>Очереди:</b>\n"
+    lines.append("")
+    lines.append("<b>Очереди:</b>")
     for subject, queue_list in queues.items():
-        message += f"  <u>{subject}</u>:\n"
+        lines.append(f"  <u>{subject}</u>:")
         if queue_list:
-            for i, name in enumerate(queue_list):
-                message += f"    {i+1}. {name}\n"
+            for i, uid in enumerate(queue_list):
+                lines.append(f"    {i+1}. {get_user_display_name(uid)}")
         else:
-            message += "    Очередь пуста\n"
-        message += "\n"
-
-    keyboard = [
-        [InlineKeyboardButton("← Назад", callback_data='dev_menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+            lines.append("    Очередь пуста")
+        lines.append("")
+    return lines
+
+
+def _paginate_lines(lines, limit=DB_PAGE_CHARS):
+    """Разбивает строки на страницы не длиннее limit символов (лимит Telegram - 4096)."""
+    pages, current, length = [], [], 0
+    for line in lines:
+        if current and length + len(line) + 1 > limit:
+            pages.append(current)
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        pages.append(current)
+    return pages or [[]]
+
+
+async def show_database_content(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
+    """Показывает содержимое базы данных (user_names и queues) постранично."""
+    user_id = update.effective_user.id
+    logger.info(f"[DEV_SHOW_DB] Пользователь {user_id} запросил содержимое базы данных, страница {page}.")
+
+    pages = _paginate_lines(_database_lines())
+    page = min(max(page, 0), len(pages) - 1)
+    message = "Содержимое базы данных"
+    if len(pages) > 1:
+        message += f" (стр. {page + 1}/{len(pages)})"
+    message += ":\n\n" + "\n".join(pages[page])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀", callback_data=f'dev_show_db_{page - 1}'))
+    if page < len(pages) - 1:
+        nav.append(InlineKeyboardButton("▶", callback_data=f'dev_show_db_{page + 1}'))
+    reply_markup = InlineKeyboardMarkup([nav, *DEV_BACK_MARKUP.inline_keyboard]) if nav else DEV_BACK_MARKUP
 
     try:
-        await update.callback_query.edit_message_text(message, parse_mode='HTML', reply_markup=reply_markup)
-        logger.info(f"[DEV_SHOW_DB] Содержимое базы данных отправлено пользователю {user_id} через callback_query с кнопкой назад.")
+        await edit_message(update.callback_query, message, parse_mode='HTML', reply_markup=reply_markup)
+        logger.info(f"[DEV_SHOW_DB] Страница {page + 1}/{len(pages)} базы данных отправлена пользователю {user_id}.")
     except Exception as e:
         logger.error(f"[DEV_SHOW_DB] Ошибка при отправке содержимого базы данных пользователю {user_id}: {e}")
-        await update.callback_query.edit_message_text("Произошла ошибка при отправке содержимого базы данных.")
+        await edit_message(update.callback_query, "Произошла ошибка при отправке содержимого базы данных.")
         await show_dev_menu(update, context)
 
 async def start_remove_user_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -127,7 +267,7 @@ async def start_remove_user_process(update: Update, context: ContextTypes.DEFAUL
     keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_menu')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text("Выберите предмет, из очереди которого нужно удалить пользователя:", reply_markup=reply_markup)
+    await edit_message(query, "Выберите предмет, из очереди которого нужно удалить пользователя:", reply_markup=reply_markup)
 
 async def select_subject_for_removal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор предмета и запрашивает выбор пользователя."""
@@ -138,7 +278,7 @@ async def select_subject_for_removal(update: Update, context: ContextTypes.DEFAU
 
     if user_id not in awaiting_subject_selection:
         logger.warning(f"[DEV_SELECT_SUBJECT_REMOVE] Пользователь {user_id} не в состоянии ожидания выбора предмета.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -147,31 +287,56 @@ async def select_subject_for_removal(update: Update, context: ContextTypes.DEFAU
     awaiting_subject_selection.discard(user_id)
     awaiting_user_selection.add(user_id)
 
-    queue_users = queues[subject]
-    if not queue_users:
-        await query.edit_message_text(f"Очередь по '{subject}' пуста.")
+    if not queues[subject]:
+        await edit_message(query, f"Очередь по '{subject}' пуста.")
         await start_remove_user_process(update, context)
         return
 
+    text, reply_markup = _render_removal_picker(subject)
+    await edit_message(query, text, reply_markup=reply_markup)
+
+def _render_removal_picker(subject, page=0):
+    """
+    Текст и клавиатура страницы выбора пользователя для удаления из очереди.
+    Страница строится через QueueStore.slice за O(log n + PICKER_PAGE_SIZE).
+    """
+    queue = queues[subject]
+    page_count = max(1, -(-len(queue) // PICKER_PAGE_SIZE))
+    page = min(max(page, 0), page_count - 1)
+    start = page * PICKER_PAGE_SIZE
+
     keyboard = []
-    for name in queue_users:
-        # Найдем ID пользователя по имени
-        user_id_to_remove = None
-        for id, data in user_names.items():
-            if data["name"] == name:
-                user_id_to_remove = id
-                break
-        # Используем ID в callback_data
-        if user_id_to_remove is not None:
-            keyboard.append([InlineKeyboardButton(name, callback_data=f'dev_confirm_remove_user_{user_id_to_remove}')])
-        else:
-            logger.warning(f"[DEV_SELECT_SUBJECT_REMOVE] Имя '{name}' из очереди '{subject}' не найдено в user_names.")
+    # Очередь хранит ID - используем их в callback_data напрямую
+    for position, user_id_to_remove in enumerate(queue.slice(start, start + PICKER_PAGE_SIZE), start=start + 1):
+        if user_id_to_remove not in user_names:
+            logger.warning(f"[DEV_SELECT_SUBJECT_REMOVE] ID {user_id_to_remove} из очереди '{subject}' не найден в user_names.")
             continue
-
+        name = user_names[user_id_to_remove]["name"]
+        keyboard.append([InlineKeyboardButton(f"{position}. {name}", callback_data=f'dev_confirm_remove_user_{user_id_to_remove}')])
+    if page_count > 1:
+        keyboard.append(_page_nav(page, page_count, 'dev_remove_page_'))
     keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_remove_user_start')])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"Выберите пользователя для удаления из очереди '{subject}':", reply_markup=reply_markup)
+    text = f"Выберите пользователя для удаления из очереди '{subject}':"
+    if not queue:
+        text += "\nОчередь пуста."
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_removal_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание страниц выбора пользователя для удаления из очереди."""
+    user_id = update.effective_user.id
+    query = update.callback_query
+    await query.answer()
+
+    subject = selected_subject_for_removal.get(user_id)
+    if user_id not in awaiting_user_selection or not subject:
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
+        await show_dev_menu(update, context)
+        return
+
+    page = int(query.data.split('dev_remove_page_')[1])
+    text, reply_markup = _render_removal_picker(subject, page)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def confirm_remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Подтверждает удаление выбранного пользователя из очереди по выбранному предмету."""
@@ -182,7 +347,7 @@ async def confirm_remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if user_id not in awaiting_user_selection:
         logger.warning(f"[DEV_CONFIRM_REMOVE] Пользователь {user_id} не в состоянии ожидания выбора пользователя для удаления.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -191,7 +356,7 @@ async def confirm_remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE
         selected_user_id = int(selected_user_id_str)
     except ValueError:
         logger.error(f"[DEV_CONFIRM_REMOVE] Неверный формат ID пользователя '{selected_user_id_str}' от {user_id}.")
-        await query.edit_message_text("Ошибка: некорректный ID пользователя.")
+        await edit_message(query, "Ошибка: некорректный ID пользователя.")
         await show_dev_menu(update, context)
         return
 
@@ -199,25 +364,26 @@ async def confirm_remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if not subject:
         logger.error(f"[DEV_CONFIRM_REMOVE] Не найден выбранный предмет для пользователя {user_id}.")
-        await query.edit_message_text("Ошибка: предмет не выбран. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка: предмет не выбран. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
     # Проверим, существует ли пользователь
     if selected_user_id not in user_names:
         logger.warning(f"[DEV_CONFIRM_REMOVE] Пользователь с ID {selected_user_id} не найден в user_names при попытке удалить из очереди '{subject}' от {user_id}.")
-        await query.edit_message_text(f"Пользователь с ID {selected_user_id} не найден в базе данных.")
+        await edit_message(query, f"Пользователь с ID {selected_user_id} не найден в базе данных.")
         await start_remove_user_process(update, context)
         return
 
     selected_user_name = user_names[selected_user_id]["name"]
 
-    success = remove_user_from_queue(selected_user_id, subject)
+    async with queue_lock(subject):
+        success = remove_user_from_queue(selected_user_id, subject)
     if success:
-        await query.edit_message_text(f"Пользователь '{selected_user_name}' успешно удален из очереди '{subject}'.")
+        await edit_message(query, f"Пользователь '{selected_user_name}' успешно удален из очереди '{subject}'.")
         logger.info(f"[DEV_CONFIRM_REMOVE] Пользователь {user_id} удалил '{selected_user_name}' (ID {selected_user_id}) из очереди '{subject}'.")
     else:
-        await query.edit_message_text(f"Не удалось удалить '{selected_user_name}' из очереди '{subject}'. Возможно, пользователь уже был удален.")
+        await edit_message(query, f"Не удалось удалить '{selected_user_name}' из очереди '{subject}'. Возможно, пользователь уже был удален.")
         logger.warning(f"[DEV_CONFIRM_REMOVE] Функция remove_user_from_queue вернула False при удалении '{selected_user_name}' (ID {selected_user_id}) из очереди '{subject}' пользователем {user_id}.")
 
     awaiting_user_selection.discard(user_id)
@@ -243,18 +409,13 @@ async def start_forget_user_process(update: Update, context: ContextTypes.DEFAUL
     awaiting_user_forget_selection.add(user_id)
 
     if not user_names:
-        await query.edit_message_text("Нет зарегистрированных пользователей для удаления.")
+        await edit_message(query, "Нет зарегистрированных пользователей для удаления.")
         await show_dev_menu(update, context)
         return
 
-    keyboard = []
-    for uid, data in user_names.items():
-        keyboard.append([InlineKeyboardButton(f"{data['name']} (ID: {uid})", callback_data=f'dev_confirm_forget_user_{uid}')])
-
-    keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_menu')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text("Выберите пользователя, которого нужно 'забыть' (удалить из базы данных):", reply_markup=reply_markup)
+    _start_user_picker(user_id, 'forget')
+    text, reply_markup = _render_user_picker(user_id)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def confirm_forget_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Подтверждает "забывание" выбранного пользователя."""
@@ -265,7 +426,7 @@ async def confirm_forget_user(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if user_id not in awaiting_user_forget_selection:
         logger.warning(f"[DEV_CONFIRM_FORGET] Пользователь {user_id} не в состоянии ожидания выбора пользователя для 'забывания'.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -274,33 +435,23 @@ async def confirm_forget_user(update: Update, context: ContextTypes.DEFAULT_TYPE
         selected_user_id = int(selected_user_id_str)
     except ValueError:
         logger.error(f"[DEV_CONFIRM_FORGET] Неверный формат ID пользователя '{selected_user_id_str}' от {user_id}.")
-        await query.edit_message_text("Ошибка: некорректный ID пользователя.")
+        await edit_message(query, "Ошибка: некорректный ID пользователя.")
         await show_dev_menu(update, context)
         return
 
     if selected_user_id not in user_names:
         logger.warning(f"[DEV_CONFIRM_FORGET] Пользователь с ID {selected_user_id} не найден в user_names при попытке 'забыть' от {user_id}.")
-        await query.edit_message_text(f"Пользователь с ID {selected_user_id} не найден в базе данных.")
+        await edit_message(query, f"Пользователь с ID {selected_user_id} не найден в базе данных.")
         await start_forget_user_process(update, context)
         return
 
     selected_user_name = user_names[selected_user_id]["name"]
 
-    del user_names[selected_user_id]
-    logger.info(f"[DEV_CONFIRM_FORGET] Пользователь '{selected_user_name}' (ID {selected_user_id}) удалён из user_names пользователем {user_id}.")
-
-    queues_changed = False
-    for subject in queues:
-        if selected_user_name in queues[subject]:
-            queues[subject].remove(selected_user_name)
-            queues_changed = True
-            logger.info(f"[DEV_CONFIRM_FORGET] Пользователь '{selected_user_name}' (ID {selected_user_id}) удалён из очереди '{subject}'.")
-
-    from data import save_data_to_file
-    save_data_to_file()
+    # Удаляет пользователя из user_names и из всех очередей
+    forget_user(selected_user_id)
     logger.info(f"[DEV_CONFIRM_FORGET] Данные сохранены после 'забывания' пользователя {selected_user_id} ({selected_user_name}) пользователем {user_id}.")
 
-    await query.edit_message_text(f"Пользователь '{selected_user_name}' (ID {selected_user_id}) успешно 'забыт' (удалён из базы данных).")
+    await edit_message(query, f"Пользователь '{selected_user_name}' (ID {selected_user_id}) успешно 'забыт' (удалён из базы данных).")
     await show_dev_menu(update, context)
 
 # --- Новые функции для добавления в очередь ---
@@ -331,7 +482,7 @@ async def start_add_user_process(update: Update, context: ContextTypes.DEFAULT_T
     keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_menu')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text("Выберите предмет, в очередь которого нужно добавить пользователя:", reply_markup=reply_markup)
+    await edit_message(query, "Выберите предмет, в очередь которого нужно добавить пользователя:", reply_markup=reply_markup)
 
 async def select_subject_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор предмета и запрашивает выбор пользователя."""
@@ -342,7 +493,7 @@ async def select_subject_for_add(update: Update, context: ContextTypes.DEFAULT_T
 
     if user_id not in awaiting_subject_selection_add:
         logger.warning(f"[DEV_SELECT_SUBJECT_ADD] Пользователь {user_id} не в состоянии ожидания выбора предмета для добавления.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -354,19 +505,14 @@ async def select_subject_for_add(update: Update, context: ContextTypes.DEFAULT_T
     awaiting_user_selection_add.add(user_id)
 
     if not user_names:
-        await query.edit_message_text("Нет зарегистрированных пользователей для добавления.")
+        await edit_message(query, "Нет зарегистрированных пользователей для добавления.")
         # Возвращаем в меню выбора предмета
         await start_add_user_process(update, context)
         return
 
-    keyboard = []
-    for uid, data in user_names.items():
-        keyboard.append([InlineKeyboardButton(f"{data['name']} (ID: {uid})", callback_data=f'dev_select_user_add_{uid}')])
-
-    keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_add_user_start')])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"Выберите пользователя для добавления в очередь '{subject}':", reply_markup=reply_markup)
+    _start_user_picker(user_id, 'add')
+    text, reply_markup = _render_user_picker(user_id)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def select_user_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор пользователя и запрашивает выбор позиции."""
@@ -377,7 +523,7 @@ async def select_user_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if user_id not in awaiting_user_selection_add:
         logger.warning(f"[DEV_SELECT_USER_ADD] Пользователь {user_id} не в состоянии ожидания выбора пользователя для добавления.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -386,14 +532,14 @@ async def select_user_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE
         selected_user_id = int(selected_user_id_str)
     except ValueError:
         logger.error(f"[DEV_SELECT_USER_ADD] Неверный формат ID пользователя '{selected_user_id_str}' от {user_id}.")
-        await query.edit_message_text("Ошибка: некорректный ID пользователя.")
+        await edit_message(query, "Ошибка: некорректный ID пользователя.")
         await show_dev_menu(update, context)
         return
 
     # Проверим, существует ли пользователь
     if selected_user_id not in user_names:
         logger.warning(f"[DEV_SELECT_USER_ADD] Пользователь с ID {selected_user_id} не найден в user_names при попытке добавить от {user_id}.")
-        await query.edit_message_text(f"Пользователь с ID {selected_user_id} не найден в базе данных.")
+        await edit_message(query, f"Пользователь с ID {selected_user_id} не найден в базе данных.")
         # Возвращаем в меню выбора пользователя
         await select_subject_for_add(update, context)
         return
@@ -401,7 +547,7 @@ async def select_user_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE
     subject = selected_subject_for_add.get(user_id)
     if not subject:
         logger.error(f"[DEV_SELECT_USER_ADD] Не найден выбранный предмет для пользователя {user_id} при выборе пользователя.")
-        await query.edit_message_text("Ошибка: предмет не выбран. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка: предмет не выбран. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -412,16 +558,50 @@ async def select_user_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE
     awaiting_user_selection_add.discard(user_id)
     awaiting_position_selection_add.add(user_id)
 
-    queue_length = len(queues[subject])
-    keyboard = []
-    # Позиции от 1 до длины очереди (вставка в середину/начало) и +1 (вставка в конец)
-    for pos in range(1, queue_length + 2):
-        keyboard.append([InlineKeyboardButton(f"Позиция {pos}", callback_data=f'dev_select_position_add_{pos}')])
+    text, reply_markup = _render_position_picker(user_id)
+    await edit_message(query, text, reply_markup=reply_markup)
+
+def _render_position_picker(user_id, page=0):
+    """
+    Текст и клавиатура страницы выбора позиции для добавления в очередь.
+    Позиции от 1 до длины очереди (вставка перед стоящим там пользователем) и +1 (вставка в конец);
+    стоящие на позициях страницы берутся через QueueStore.slice за O(log n + PICKER_PAGE_SIZE).
+    """
+    subject = selected_subject_for_add[user_id]
+    selected_user_name = user_names[selected_user_for_add[user_id]]["name"]
+    queue = queues[subject]
+    queue_length = len(queue)
+    page_count = -(-(queue_length + 1) // PICKER_PAGE_SIZE)
+    page = min(max(page, 0), page_count - 1)
+    start = page * PICKER_PAGE_SIZE
 
+    keyboard = [
+        [InlineKeyboardButton(f"Позиция {pos} (перед {get_user_display_name(uid)})", callback_data=f'dev_select_position_add_{pos}')]
+        for pos, uid in enumerate(queue.slice(start, start + PICKER_PAGE_SIZE), start=start + 1)
+    ]
+    if start + PICKER_PAGE_SIZE > queue_length:
+        keyboard.append([InlineKeyboardButton(f"Позиция {queue_length + 1} (в конец)", callback_data=f'dev_select_position_add_{queue_length + 1}')])
+    if page_count > 1:
+        keyboard.append(_page_nav(page, page_count, 'dev_add_position_page_'))
     keyboard.append([InlineKeyboardButton("← Назад", callback_data=f'dev_select_subject_add_{subject}')])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"Выбран пользователь '{selected_user_name}' для добавления в очередь '{subject}'.\nТекущая длина очереди: {queue_length}.\nВыберите позицию (1 - в начало, {queue_length + 1} - в конец):", reply_markup=reply_markup)
+    text = f"Выбран пользователь '{selected_user_name}' для добавления в очередь '{subject}'.\nТекущая длина очереди: {queue_length}.\nВыберите позицию (1 - в начало, {queue_length + 1} - в конец):"
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_position_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание страниц выбора позиции для добавления в очередь."""
+    user_id = update.effective_user.id
+    query = update.callback_query
+    await query.answer()
+
+    if user_id not in awaiting_position_selection_add or user_id not in selected_subject_for_add or selected_user_for_add.get(user_id) not in user_names:
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
+        await show_dev_menu(update, context)
+        return
+
+    page = int(query.data.split('dev_add_position_page_')[1])
+    text, reply_markup = _render_position_picker(user_id, page)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def select_position_for_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор позиции и добавляет пользователя."""
@@ -432,7 +612,7 @@ async def select_position_for_add(update: Update, context: ContextTypes.DEFAULT_
 
     if user_id not in awaiting_position_selection_add:
         logger.warning(f"[DEV_SELECT_POSITION_ADD] Пользователь {user_id} не в состоянии ожидания выбора позиции для добавления.")
-        await query.edit_message_text("Ошибка состояния. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка состояния. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -441,7 +621,7 @@ async def select_position_for_add(update: Update, context: ContextTypes.DEFAULT_
         selected_position = int(selected_position_str)
     except ValueError:
         logger.error(f"[DEV_SELECT_POSITION_ADD] Неверный формат позиции '{selected_position_str}' от {user_id}.")
-        await query.edit_message_text("Ошибка: некорректная позиция.")
+        await edit_message(query, "Ошибка: некорректная позиция.")
         await show_dev_menu(update, context)
         return
 
@@ -450,36 +630,32 @@ async def select_position_for_add(update: Update, context: ContextTypes.DEFAULT_
 
     if not subject or selected_user_id is None:
         logger.error(f"[DEV_SELECT_POSITION_ADD] Не найдены предмет или пользователь для {user_id} при выборе позиции.")
-        await query.edit_message_text("Ошибка: данные пользователя или предмета не найдены. Пожалуйста, начните снова.")
+        await edit_message(query, "Ошибка: данные пользователя или предмета не найдены. Пожалуйста, начните снова.")
         await show_dev_menu(update, context)
         return
 
     selected_user_name = user_names[selected_user_id]["name"]
 
-    # Проверим, что позиция в допустимом диапазоне (1 до len+1)
-    queue_length = len(queues[subject])
-    if selected_position < 1 or selected_position > queue_length + 1:
+    # Проверка позиции и вставка под одним локом: очередь могла измениться,
+    # пока разработчик выбирал позицию
+    async with queue_lock(subject):
+        # Проверим, что позиция в допустимом диапазоне (1 до len+1)
+        queue_length = len(queues[subject])
+        position_valid = 1 <= selected_position <= queue_length + 1
+        if position_valid:
+            # Вставляем на выбранную позицию (преобразуем 1-нумерацию в 0-нумерацию индекса).
+            # Если пользователь уже в очереди, он будет перенесён, а не продублирован.
+            add_user_to_queue(selected_user_id, subject, selected_position - 1)
+
+    if not position_valid:
         logger.warning(f"[DEV_SELECT_POSITION_ADD] Пользователь {user_id} выбрал недопустимую позицию {selected_position} для очереди '{subject}' (длина {queue_length}).")
-        await query.edit_message_text(f"Недопустимая позиция. Выберите от 1 до {queue_length + 1}.")
         # Возвращаем к выбору позиции
-        await select_user_for_add(update, context)
+        text, reply_markup = _render_position_picker(user_id)
+        await edit_message(query, f"Недопустимая позиция. Выберите от 1 до {queue_length + 1}.\n\n{text}", reply_markup=reply_markup)
         return
-
-    # Удаляем пользователя из очереди, если он уже там (чтобы не дублировать)
-    if selected_user_name in queues[subject]:
-        queues[subject].remove(selected_user_name)
-        logger.info(f"[DEV_SELECT_POSITION_ADD] Пользователь '{selected_user_name}' (ID {selected_user_id}) удален из очереди '{subject}' перед добавлением на новую позицию.")
-
-    # Вставляем на выбранную позицию (преобразуем 1-нумерацию в 0-нумерацию индекса)
-    queues[subject].insert(selected_position - 1, selected_user_name)
-    logger.info(f"[DEV_SELECT_POSITION_ADD] Пользователь '{selected_user_name}' (ID {selected_user_id}) добавлен в очередь '{subject}' на позицию {selected_position} пользователем {user_id}.")
-
-    # Сохраняем изменения
-    from data import save_data_to_file
-    save_data_to_file()
     logger.info(f"[DEV_SELECT_POSITION_ADD] Данные сохранены после добавления пользователя {selected_user_id} ({selected_user_name}) в очередь '{subject}' на позицию {selected_position} пользователем {user_id}.")
 
-    await query.edit_message_text(f"Пользователь '{selected_user_name}' успешно добавлен в очередь '{subject}' на позицию {selected_position}.")
+    await edit_message(query, f"Пользователь '{selected_user_name}' успешно добавлен в очередь '{subject}' на позицию {selected_position}.")
     # Очищаем состояния
     awaiting_position_selection_add.discard(user_id)
     selected_subject_for_add.pop(user_id, None)
@@ -496,27 +672,14 @@ async def clean_queues_from_unknown(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     await query.answer()
 
-    total_removed = 0
-    user_names_list = [data["name"] for data in user_names.values()]
-    
-    for subject, queue_list in queues.items():
-        original_length = len(queue_list)
-        # Фильтруем очередь, оставляя только имена, которые есть в user_names
-        cleaned_queue = [name for name in queue_list if name in user_names_list]
-        removed_count = original_length - len(cleaned_queue)
-        total_removed += removed_count
-        if removed_count > 0:
-            queues[subject] = cleaned_queue
-            logger.info(f"[DEV_CLEAN_UNKNOWN] Из очереди '{subject}' удалено {removed_count} неизвестных пользователей.")
+    # Оставляем в очередях только ID, которые есть в user_names
+    total_removed = remove_unknown_from_queues()
 
     if total_removed > 0:
-        # Сохраняем изменения
-        from data import save_data_to_file
-        save_data_to_file()
         logger.info(f"[DEV_CLEAN_UNKNOWN] Данные сохранены после удаления {total_removed} неизвестных пользователей.")
-        await query.edit_message_text(f"Очистка завершена. Удалено {total_removed} неизвестных пользователей из всех очередей.")
+        await edit_message(query, f"Очистка завершена. Удалено {total_removed} неизвестных пользователей из всех очередей.")
     else:
-        await query.edit_message_text("Очистка завершена. Неизвестных пользователей не найдено.")
+        await edit_message(query, "Очистка завершена. Неизвестных пользователей не найдено.")
     # Возвращаем в главное меню разработчика
     await show_dev_menu(update, context)
 
@@ -532,20 +695,14 @@ async def start_ban_user_process(update: Update, context: ContextTypes.DEFAULT_T
     awaiting_ban_user_selection.discard(user_id)
     
     if not user_names:
-        await query.edit_message_text("Нет зарегистрированных пользователей для бана.")
+        await edit_message(query, "Нет зарегистрированных пользователей для бана.")
         await show_dev_menu(update, context)
         return
     
     awaiting_ban_user_selection.add(user_id)
-    keyboard = []
-    for uid, data in user_names.items():
-        if not data.get("banned", False):
-            keyboard.append([InlineKeyboardButton(f"{data['name']} (ID: {uid})", callback_data=f'dev_select_ban_user_{uid}')])
-    
-    keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_menu')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text("Выберите пользователя для бана:", reply_markup=reply_markup)
+    _start_user_picker(user_id, 'ban')
+    text, reply_markup = _render_user_picker(user_id)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def confirm_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Выполняет бан пользователя и отправляет ему уведомление."""
@@ -555,7 +712,7 @@ async def confirm_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     if user_id not in awaiting_ban_user_selection:
         logger.warning(f"[DEV_BAN_CONFIRM] Пользователь {user_id} не в состоянии ожидания.")
-        await query.edit_message_text("Ошибка состояния. Начните снова.")
+        await edit_message(query, "Ошибка состояния. Начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -564,12 +721,12 @@ async def confirm_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         selected_user_id = int(selected_user_id_str)
     except ValueError:
         logger.error(f"[DEV_BAN_CONFIRM] Неверный ID {selected_user_id_str}.")
-        await query.edit_message_text("Ошибка: некорректный ID пользователя.")
+        await edit_message(query, "Ошибка: некорректный ID пользователя.")
         await show_dev_menu(update, context)
         return
 
     if selected_user_id not in user_names:
-        await query.edit_message_text("Пользователь не найден в базе данных.")
+        await edit_message(query, "Пользователь не найден в базе данных.")
         await start_ban_user_process(update, context)
         return
 
@@ -577,11 +734,11 @@ async def confirm_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # success = ban_user(selected_user_id) # <-- БЫЛО
     success = await ban_user(selected_user_id, app_instance=context.application) # <-- СТАЛО
     if success:
-        await query.edit_message_text(f"✅ Пользователь '{selected_user_name}' (ID: {selected_user_id}) успешно забанен.")
+        await edit_message(query, f"✅ Пользователь '{selected_user_name}' (ID: {selected_user_id}) успешно забанен.")
         logger.info(f"[DEV_BAN_CONFIRM] Пользователь {user_id} забанил '{selected_user_name}' (ID {selected_user_id}).")
         # УВЕДОМЛЕНИЕ отправляется внутри ban_user
     else:
-        await query.edit_message_text(f"❌ Не удалось забанить пользователя. Возможно, он уже забанен.")
+        await edit_message(query, f"❌ Не удалось забанить пользователя. Возможно, он уже забанен.")
         logger.warning(f"[DEV_BAN_CONFIRM] Не удалось забанить {selected_user_id}.")
 
     awaiting_ban_user_selection.discard(user_id)
@@ -601,19 +758,14 @@ async def start_unban_user_process(update: Update, context: ContextTypes.DEFAULT
     banned_list = get_all_banned_users()
     
     if not banned_list:
-        await query.edit_message_text("Список забаненных пользователей пуст.")
+        await edit_message(query, "Список забаненных пользователей пуст.")
         await show_dev_menu(update, context)
         return
     
     awaiting_unban_user_selection.add(user_id)
-    keyboard = []
-    for uid, data in banned_list.items():
-        keyboard.append([InlineKeyboardButton(f"{data['name']} (ID: {uid})", callback_data=f'dev_confirm_unban_user_{uid}')])
-    
-    keyboard.append([InlineKeyboardButton("← Назад", callback_data='dev_menu')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text("Выберите пользователя для разбана:", reply_markup=reply_markup)
+    _start_user_picker(user_id, 'unban')
+    text, reply_markup = _render_user_picker(user_id)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 async def confirm_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Выполняет разбан пользователя."""
@@ -623,7 +775,7 @@ async def confirm_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     if user_id not in awaiting_unban_user_selection:
         logger.warning(f"[DEV_UNBAN_CONFIRM] Пользователь {user_id} не в состоянии ожидания.")
-        await query.edit_message_text("Ошибка состояния. Начните снова.")
+        await edit_message(query, "Ошибка состояния. Начните снова.")
         await show_dev_menu(update, context)
         return
 
@@ -632,27 +784,17 @@ async def confirm_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
         selected_user_id = int(selected_user_id_str)
     except ValueError:
         logger.error(f"[DEV_UNBAN_CONFIRM] Неверный ID {selected_user_id_str}.")
-        await query.edit_message_text("Ошибка: некорректный ID пользователя.")
+        await edit_message(query, "Ошибка: некорректный ID пользователя.")
         await show_dev_menu(update, context)
         return
 
     success = await unban_user(selected_user_id, app_instance=context.application)
     if success:
-        await query.edit_message_text(f"✅ Пользователь {selected_user_id} успешно разбанен.")
+        await edit_message(query, f"✅ Пользователь {selected_user_id} успешно разбанен.")
         logger.info(f"[DEV_UNBAN_CONFIRM] Пользователь {user_id} разбанил {selected_user_id}.")
-        
-        # --- ОТПРАВКА УВЕДОМЛЕНИЯ РАЗБАНЕННОМУ ПОЛЬЗОВАТЕЛЮ (опционально) ---
-        try:
-            await context.bot.send_message(
-                chat_id=selected_user_id,
-                text="✅ Вы разбанены и можете снова использовать бота."
-            )
-            logger.info(f"[DEV_UNBAN_CONFIRM] Уведомление о разбане отправлено пользователю {selected_user_id}.")
-        except Exception as e:
-            logger.warning(f"[DEV_UNBAN_CONFIRM] Не удалось отправить уведомление о разбане пользователю {selected_user_id}: {e}")
-        # ---
+        # УВЕДОМЛЕНИЕ отправляется внутри unban_user
     else:
-        await query.edit_message_text(f"❌ Не удалось разбанить пользователя.")
+        await edit_message(query, f"❌ Не удалось разбанить пользователя.")
         logger.warning(f"[DEV_UNBAN_CONFIRM] Не удалось разбанить {selected_user_id}.")
 
     awaiting_unban_user_selection.discard(user_id)
@@ -676,64 +818,72 @@ async def show_ban_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for uid, data in banned_list.items():
             message += f"🚫 {data['name']} (ID: <code>{uid}</code>)\n"
     
-    keyboard = [[InlineKeyboardButton("← Назад", callback_data='dev_menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = DEV_BACK_MARKUP
     
-    await query.edit_message_text(message, parse_mode='HTML', reply_markup=reply_markup)
+    await edit_message(query, message, parse_mode='HTML', reply_markup=reply_markup)
     logger.info(f"[DEV_SHOW_BAN_LIST] Банлист показан пользователю {user_id}.")
 
 async def update_rating_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обновляет рейтинг из Яндекс.Диска и показывает топ."""
+    """Запускает обновление рейтинга из Яндекс.Диска в фоне и показывает его ход."""
     user_id = update.effective_user.id
     logger.info(f"[DEV_RATING] Пользователь {user_id} обновляет рейтинг")
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text("⏳ Обновляю рейтинг из Яндекс.Диска...")
-
-    # Обновляем рейтинг
-    result = update_rating('ЯП')
-    if result:
-        logger.info(f"[DEV_RATING] Рейтинг успешно обновлен ({len(result)} студентов)")
-
-        # Извлекаем только фамилии и сортируем
-        surname_scores = {}
-        for full_name, score in result.items():
-            surname = full_name.split()[0]  # Берём первую часть (фамилию)
-            surname_scores[surname] = score
-
-        sorted_data = sorted(surname_scores.items(), key=lambda x: x[1], reverse=True)
-
-        # Разбиваем на части по 27 студентов (чтобы уложиться в лимиты сообщения с форматированием)
-        chunk_size = 27
-        chunks = [sorted_data[i:i + chunk_size] for i in range(0, len(sorted_data), chunk_size)]
-
-        # Отправляем каждую часть отдельным сообщением
-        for chunk_idx, chunk in enumerate(chunks, start=1):
-            message = f"<b>Рейтинг по ЯП :</b>\n\n"
-            for rank, (surname, score) in enumerate(chunk, start=(chunk_idx - 1) * chunk_size + 1):
-                medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"{rank}."
-                message += f"{medal} <b>{surname}</b> — {score:.2f} лаб\n"
-            
-            if chunk_idx == len(chunks):
-                keyboard = [[InlineKeyboardButton("← Назад", callback_data='dev_menu')]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-            else:
-                reply_markup = None
-            
-            await context.bot.send_message(
-                chat_id=query.from_user.id,
-                text=message,
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
-        logger.info(f"[DEV_RATING] Отправлено {len(chunks)} сообщений с рейтингом")
+
+    task = rating_refresh_tasks.get(user_id)
+    if task is not None and not task.done():
+        await edit_message(query, "⏳ Рейтинг уже обновляется...", reply_markup=RATING_CANCEL_MARKUP)
+        return
+
+    await edit_message(query, "⏳ Обновляю рейтинг из Яндекс.Диска...", reply_markup=RATING_CANCEL_MARKUP)
+    # Обработчик не ждёт обновления: апдейты разработчика (в том числе "Отменить")
+    # обрабатываются по очереди, а остальные пользователи обслуживаются параллельно
+    # Если обновление уже запущено (другим разработчиком или по расписанию), задача дождётся его
+    rating_refresh_tasks[user_id] = context.application.create_task(_run_rating_refresh(query, context))
+
+async def _run_rating_refresh(query, context):
+    async def progress(text):
+        await edit_message(query, text, reply_markup=RATING_CANCEL_MARKUP)
+
+    try:
+        # Обновляем рейтинги всех предметов одной загрузкой книги
+        results = await refresh_ratings(progress=progress)
+    except asyncio.CancelledError:
+        logger.info(f"[DEV_RATING] Обновление рейтинга отменено")
+        await edit_message(query, "⏹ Обновление рейтинга отменено", reply_markup=DEV_BACK_MARKUP)
+        return
+    except Exception as e:
+        logger.error(f"[DEV_RATING] Ошибка обновления рейтинга: {e}")
+        results = None
+
+    if results:
+        logger.info(f"[DEV_RATING] Рейтинг успешно обновлен: " + ", ".join(f"{subject} - {len(data)}" for subject, data in results.items()))
+        # Вместо всего рейтинга показываем, что изменилось (сам рейтинг доступен по "Рейтинг")
+        summary = format_rating_delta(results, get_last_rating_deltas())
+        if len(summary) > 4000:
+            summary = summary[:4000].rsplit("\n", 1)[0] + "\n…"
+        await edit_message(query, "✅ Рейтинг обновлен\n\n" + summary, parse_mode='HTML', reply_markup=DEV_BACK_MARKUP)
     else:
         message = "❌ Ошибка при обновлении рейтинга"
-        keyboard = [[InlineKeyboardButton("← Назад", callback_data='dev_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup)
+        reply_markup = DEV_BACK_MARKUP
+        await edit_message(query, message, reply_markup=reply_markup)
         logger.error(f"[DEV_RATING] Ошибка обновления рейтинга")
 
+async def cancel_rating_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отменяет идущее обновление рейтинга."""
+    user_id = update.effective_user.id
+    query = update.callback_query
+    task = rating_refresh_tasks.get(user_id)
+    if task is None or task.done():
+        await query.answer("Обновление рейтинга не идёт.")
+        await show_dev_menu(update, context)
+        return
+    await query.answer("Отменяю обновление...")
+    logger.info(f"[DEV_RATING] Пользователь {user_id} отменяет обновление рейтинга")
+    # Отменяется само обновление (его ждут и другие); если оно уже закончилось - отправка страниц
+    if not cancel_rating_refresh():
+        task.cancel()
+
 
 async def go_back_to_user_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Возвращает пользователя из dev-меню в обычное меню."""
@@ -783,8 +933,12 @@ async def handle_dev_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         awaiting_position_selection_add.discard(user_id)
         awaiting_ban_user_selection.discard(user_id)
         awaiting_unban_user_selection.discard(user_id)
+        user_pickers.pop(user_id, None)
+        awaiting_picker_search.discard(user_id)
         await show_dev_menu(update, context)
-    elif data == 'dev_show_db':
+    elif data.startswith('dev_picker_'):
+        await handle_user_picker_callback(update, context)
+    elif data.startswith('dev_show_db'):
         awaiting_subject_selection.discard(user_id)
         awaiting_user_selection.discard(user_id)
         selected_subject_for_removal.pop(user_id, None)
@@ -794,7 +948,8 @@ async def handle_dev_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         selected_subject_for_add.pop(user_id, None)
         selected_user_for_add.pop(user_id, None)
         awaiting_position_selection_add.discard(user_id)
-        await show_database_content(update, context)
+        page = data[len('dev_show_db_'):]
+        await show_database_content(update, context, int(page) if page.isdigit() else 0)
     # --- Новые обработчики для добавления СТОЯТ ПЕРВЫМИ ---
     elif data == 'dev_add_user_start':
         await start_add_user_process(update, context)
@@ -804,11 +959,15 @@ async def handle_dev_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         await select_user_for_add(update, context)
     elif data.startswith('dev_select_position_add_'):
         await select_position_for_add(update, context)
+    elif data.startswith('dev_add_position_page_'):
+        await show_position_page(update, context)
     # ---
     elif data == 'dev_remove_user_start':
         await start_remove_user_process(update, context)
     elif data.startswith('dev_select_subject_'): # Теперь обрабатывает только удаление
         await select_subject_for_removal(update, context)
+    elif data.startswith('dev_remove_page_'):
+        await show_removal_page(update, context)
     elif data.startswith('dev_confirm_remove_user_'):
         await confirm_remove_user(update, context)
     elif data == 'dev_forget_user_start':
@@ -832,6 +991,8 @@ async def handle_dev_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     # ---
     elif data == 'dev_update_rating':  # <-- НОВЫЙ ОБРАБОТЧИК
         await update_rating_handler(update, context)
+    elif data == 'dev_cancel_rating':
+        await cancel_rating_update(update, context)
         return  # ВАЖНО: не вызываем show_dev_menu снова
     elif data == 'dev_back_to_user_menu':
         await go_back_to_user_menu(update, context)
@@ -0,0 +1,63 @@
+# editing.py
+
+import logging
+from collections import OrderedDict
+from telegram.error import BadRequest
+from constants import EDIT_CACHE_SIZE
+from outbox import scheduler, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, message_id) -> отпечаток последнего показанного текста и клавиатуры.
+# OrderedDict работает как LRU: при переполнении выбрасываются самые давние сообщения.
+_last_rendered = OrderedDict()
+
+
+def _message_key(query):
+    message = query.message
+    if message is not None:
+        return (message.chat.id, message.message_id)
+    return (None, query.inline_message_id)
+
+
+def _fingerprint(text, reply_markup, parse_mode):
+    # Клавиатуры - неизменяемые TelegramObject и хешируются по содержимому
+    return hash((text, parse_mode, reply_markup))
+
+
+def _remember(key, fingerprint):
+    _last_rendered[key] = fingerprint
+    _last_rendered.move_to_end(key)
+    while len(_last_rendered) > EDIT_CACHE_SIZE:
+        _last_rendered.popitem(last=False)
+
+
+async def edit_message(query, text, reply_markup=None, parse_mode=None):
+    """
+    Редактирует сообщение callback-запроса, только если текст или клавиатура меняются.
+    Повторное нажатие той же кнопки не вызывает edit_message_text, который Telegram всё равно
+    отклонил бы с "message is not modified". Возвращает True, если сообщение было изменено.
+    """
+    key = _message_key(query)
+    fingerprint = _fingerprint(text, reply_markup, parse_mode)
+    if _last_rendered.get(key) == fingerprint:
+        _last_rendered.move_to_end(key)
+        logger.debug(f"Сообщение {key} не изменилось, редактирование пропущено.")
+        return False
+
+    try:
+        await scheduler.submit(
+            key[0],
+            lambda: query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode),
+            PRIORITY_INTERACTIVE,
+        )
+    except BadRequest as e:
+        # Сообщение уже показывает это содержимое (например, после перезапуска бота)
+        if "not modified" not in str(e).lower():
+            raise
+        logger.debug(f"Telegram: сообщение {key} не изменилось.")
+        _remember(key, fingerprint)
+        return False
+
+    _remember(key, fingerprint)
+    return True
@@ -1,10 +1,15 @@
 import logging
 import httpx
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters
 from constants import BOT_TOKEN
+from update_processor import PerUserUpdateProcessor
 import user_handlers
 import dev_handlers
-from data import user_names, is_user_banned
+from notifications import start_notifications, stop_notifications
+from outbox import start_outbox, stop_outbox
+from rating import start_rating_refresh, stop_rating_refresh
+from data import user_names, is_user_banned, register_user, start_persistence, stop_persistence
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -13,17 +18,17 @@ logging.basicConfig(
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+async def drop_banned_updates(update, context):
+    """Отбрасывает апдейты забаненных пользователей до того, как они дойдут до обработчиков."""
+    user = update.effective_user
+    if user is not None and is_user_banned(user.id):
+        # Не отправляем сообщение, просто игнорируем
+        user_handlers.logger.info(f"Апдейт от забаненного пользователя {user.id} проигнорирован.")
+        raise ApplicationHandlerStop
+
 async def combined_message_handler(update, context):
     """Комбинированный обработчик текстовых сообщений."""
     user_id = update.effective_user.id
-    
-    # Проверка бана ПЕРВЫМ ДЕЛОМ
-    if is_user_banned(user_id):
-        # Не отправляем сообщение, просто игнорируем
-        user_handlers.logger.info(f"Сообщение от забаненного пользователя {user_id} проигнорировано: '{update.message.text}'")
-        # ВАЖНО: НЕ вызываем await update.message.reply_text("❌ Вы забанены...")
-        return
-    
     text = update.message.text
     
     # Получаем имя пользователя
@@ -33,9 +38,7 @@ async def combined_message_handler(update, context):
 
     if user_id not in user_names:
         user_handlers.logger.info(f"Сохраняю имя '{text}' для нового пользователя {user_id}.")
-        user_names[user_id] = {"name": text, "banned": False}
-        from data import save_data_to_file
-        save_data_to_file()
+        register_user(user_id, text)
         await update.message.reply_text(f"Привет, {text}!")
         await user_handlers.show_subjects(update)
         user_handlers.logger.info(f"Имя '{text}' успешно сохранено для пользователя {user_id}.")
@@ -47,6 +50,8 @@ async def combined_message_handler(update, context):
                 return
             user_handlers.logger.info(f"Пользователь {user_id} не в dev-режиме и код не подошёл. Игнорируем.")
             return
+        if await dev_handlers.handle_picker_search(update, context):
+            return
         user_handlers.logger.info(f"Пользователь {user_id} в dev-режиме, ввёл: '{text}'. Возвращаем в меню.")
         await dev_handlers.show_dev_menu(update, context)
         return
@@ -54,15 +59,39 @@ async def combined_message_handler(update, context):
     user_handlers.logger.info(f"Нераспознанное сообщение от пользователя {user_id} ({current_user_name}): '{text}'. Игнорируется.")
     pass
 
-application = Application.builder().token(BOT_TOKEN).build()
+async def post_init(app_instance):
+    await start_persistence(app_instance)
+    await start_outbox(app_instance)
+    await start_notifications(app_instance)
+    await start_rating_refresh(app_instance)
+
+async def post_shutdown(app_instance):
+    await stop_rating_refresh(app_instance)
+    await stop_notifications(app_instance)
+    await stop_outbox(app_instance)
+    await stop_persistence(app_instance)
+
+application = (
+    Application.builder()
+    .token(BOT_TOKEN)
+    # Апдейты разных пользователей обрабатываются параллельно, одного - по порядку
+    .concurrent_updates(PerUserUpdateProcessor())
+    .post_init(post_init)
+    .post_shutdown(post_shutdown)
+    .build()
+)
 
+# Группа -1 выполняется раньше всех обработчиков: забаненные до них не доходят
+application.add_handler(TypeHandler(Update, drop_banned_updates), group=-1)
 application.add_handler(CommandHandler("start", user_handlers.start))
 application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, combined_message_handler))
 application.add_handler(CallbackQueryHandler(user_handlers.go_back, pattern='^back_to_menu$'))
 application.add_handler(CallbackQueryHandler(user_handlers.show_queue, pattern='^show_queue_'))
+application.add_handler(CallbackQueryHandler(user_handlers.show_queue_page, pattern='^queue_page_'))
 application.add_handler(CallbackQueryHandler(user_handlers.join_queue, pattern='^join_'))
+application.add_handler(CallbackQueryHandler(user_handlers.toggle_notifications, pattern='^notify_toggle_'))
 application.add_handler(CallbackQueryHandler(user_handlers.handle_passed, pattern='^passed_'))
-application.add_handler(CallbackQueryHandler(user_handlers.show_rating, pattern='^show_rating$'))
+application.add_handler(CallbackQueryHandler(user_handlers.show_rating, pattern='^show_rating'))
 application.add_handler(CallbackQueryHandler(dev_handlers.handle_dev_callback, pattern='^(dev_|back_to_menu)'))
 
 if __name__ == '__main__':
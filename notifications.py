@@ -0,0 +1,192 @@
+# notifications.py
+
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from constants import NOTIFY_COALESCE_WINDOW, NOTIFY_NEXT_K, NOTIFY_MAX_CONCURRENT
+from outbox import send_message, PRIORITY_BROADCAST
+import data
+import rating
+
+logger = logging.getLogger(__name__)
+
+# Уведомления о сдвиге места в очереди (для пользователей, включивших их).
+# data.py сообщает об изменённых очередях; изменения копятся NOTIFY_COALESCE_WINDOW секунд,
+# после чего места подписчиков сравниваются с последними известными. Поэтому серия
+# нажатий "Сдал" даёт одно сообщение на пользователя, а не по сообщению на каждое нажатие.
+#
+# Уведомления об изменении рейтинга: rating.py после обновления передаёт изменения по предметам,
+# студенты сопоставляются с пользователями по имени, и каждый получает одно сообщение
+# со всеми своими изменениями.
+
+_bot = None
+# Предметы, изменённые с последней рассылки
+_dirty_subjects = set()
+_flush_task = None
+# Предмет -> {ID подписчика: последнее известное место (с 1)}
+_known_positions = {}
+# Идущие рассылки об изменении рейтинга (ссылки, чтобы задачи не собрал сборщик мусора)
+_rating_tasks = set()
+
+
+def _on_queues_changed(subjects):
+    """Вызывается data.py после изменения очередей; планирует рассылку."""
+    global _flush_task
+    if _bot is None:
+        return
+    _dirty_subjects.update(subjects)
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_after_window())
+
+
+async def _flush_after_window():
+    await asyncio.sleep(NOTIFY_COALESCE_WINDOW)
+    await flush_notifications()
+
+
+def _collect_changes(subject):
+    """
+    Сравнивает места подписчиков в очереди с последними известными.
+    Возвращает [(ID, новое место)] для тех, кто сдвинулся и оказался среди первых NOTIFY_NEXT_K.
+    """
+    queue = data.queues[subject]
+    known = _known_positions.setdefault(subject, {})
+    changes = []
+    current = {}
+    for user_id in data.notify_ids:
+        if user_id not in queue:
+            continue
+        position = queue.index(user_id) + 1
+        current[user_id] = position
+        old_position = known.get(user_id)
+        # Только что вставший в очередь сам видит своё место - сообщать не о чем
+        if old_position is not None and position != old_position and position <= NOTIFY_NEXT_K:
+            changes.append((user_id, position))
+    _known_positions[subject] = current
+    return changes
+
+
+def _notification_text(subject, position):
+    if position == 1:
+        return f"🔔 Твоя очередь по '{subject}'!"
+    return f"🔔 Очередь по '{subject}' сдвинулась: ты теперь {position}-й."
+
+
+async def flush_notifications():
+    """Рассылает уведомления по всем изменённым с прошлой рассылки очередям."""
+    subjects = list(_dirty_subjects)
+    _dirty_subjects.clear()
+    messages = []
+    for subject in subjects:
+        for user_id, position in _collect_changes(subject):
+            messages.append((user_id, subject, _notification_text(subject, position)))
+    if not messages:
+        return
+
+    await _broadcast([
+        (user_id, text, InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Открыть очередь", callback_data=f'show_queue_{subject}')]]
+        ))
+        for user_id, subject, text in messages
+    ])
+    logger.info(f"Отправлено уведомлений о сдвиге очередей: {len(messages)}")
+
+
+async def _broadcast(messages):
+    """Рассылает [(ID, текст, клавиатура)], не больше NOTIFY_MAX_CONCURRENT запросов к Telegram одновременно."""
+    semaphore = asyncio.Semaphore(NOTIFY_MAX_CONCURRENT)
+
+    async def send(user_id, text, reply_markup):
+        async with semaphore:
+            try:
+                await send_message(_bot, user_id, text, priority=PRIORITY_BROADCAST, reply_markup=reply_markup)
+            except Exception as e:
+                logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+
+    await asyncio.gather(*(send(*message) for message in messages))
+
+
+def _rating_change_text(subject, change):
+    _, old_rank, old_score, new_rank, new_score = change
+    if old_rank is None:
+        return f"• {subject}: ты в рейтинге — {new_score:.2f} лаб, {new_rank}-е место"
+    if new_rank is None:
+        return f"• {subject}: тебя больше нет в рейтинге"
+    if old_score != new_score:
+        return f"• {subject}: {old_score:.2f} → {new_score:.2f} лаб, место {old_rank} → {new_rank}"
+    return f"• {subject}: место {old_rank} → {new_rank}"
+
+
+def _collect_rating_changes(deltas):
+    """Группирует изменения рейтинга по пользователям: {ID: [строки изменений]}."""
+    per_user = {}
+    for subject, delta in deltas.items():
+        # Первый загруженный рейтинг не с чем сравнивать - сообщать не о чем
+        if delta.initial:
+            continue
+        for change in delta.changes():
+            for user_id in data.find_users_by_name(change[0]):
+                if not data.is_user_banned(user_id):
+                    per_user.setdefault(user_id, []).append(_rating_change_text(subject, change))
+    return per_user
+
+
+def _on_ratings_changed(deltas):
+    """Вызывается rating.py после обновления, изменившего рейтинг; планирует рассылку."""
+    if _bot is None:
+        return
+    per_user = _collect_rating_changes(deltas)
+    if per_user:
+        task = asyncio.create_task(flush_rating_notifications(per_user))
+        _rating_tasks.add(task)
+        task.add_done_callback(_rating_tasks.discard)
+
+
+async def flush_rating_notifications(per_user):
+    """Отправляет каждому пользователю одно сообщение со всеми изменениями его рейтинга."""
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть рейтинг", callback_data='show_rating')]])
+    await _broadcast([
+        (user_id, "📊 Рейтинг обновился:\n" + "\n".join(lines), markup)
+        for user_id, lines in per_user.items()
+    ])
+    logger.info(f"Отправлено уведомлений об изменении рейтинга: {len(per_user)}")
+
+
+def remember_position(user_id, subject):
+    """Запоминает текущее место подписчика, чтобы следующая рассылка сравнивала с ним."""
+    queue = data.queues[subject]
+    if user_id in queue:
+        _known_positions.setdefault(subject, {})[user_id] = queue.index(user_id) + 1
+
+
+async def start_notifications(app_instance):
+    """Включает рассылку уведомлений (вызывается из post_init приложения)."""
+    global _bot
+    _bot = app_instance.bot
+    for subject, queue in data.queues.items():
+        _known_positions[subject] = {
+            user_id: queue.index(user_id) + 1 for user_id in data.notify_ids if user_id in queue
+        }
+    if _on_queues_changed not in data.queue_listeners:
+        data.queue_listeners.append(_on_queues_changed)
+    if _on_ratings_changed not in rating.rating_listeners:
+        rating.rating_listeners.append(_on_ratings_changed)
+    logger.info(f"Уведомления об очередях включены (окно {NOTIFY_COALESCE_WINDOW} с, первые {NOTIFY_NEXT_K} мест)")
+
+
+async def stop_notifications(app_instance=None):
+    """Отправляет накопленные уведомления и отключает рассылку."""
+    global _bot, _flush_task
+    if _on_queues_changed in data.queue_listeners:
+        data.queue_listeners.remove(_on_queues_changed)
+    if _on_ratings_changed in rating.rating_listeners:
+        rating.rating_listeners.remove(_on_ratings_changed)
+    if _flush_task is not None and not _flush_task.done():
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        await flush_notifications()
+    _flush_task = None
+    _bot = None
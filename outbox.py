@@ -0,0 +1,299 @@
+# outbox.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+from telegram.error import RetryAfter
+from constants import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES, SEND_MAX_IN_FLIGHT,
+    SEND_METRICS_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: меньше - раньше
+PRIORITY_INTERACTIVE = 0   # ответы на нажатия кнопок
+PRIORITY_NORMAL = 1        # одиночные сообщения (бан, разбан, вывод для разработчика)
+PRIORITY_BROADCAST = 2     # массовые рассылки
+
+
+class TokenBucket:
+    """Не больше rate запросов в секунду в среднем и не больше capacity подряд."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 - уже доступен)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+def _resolve(future, result=None, error=None):
+    # Вызывающий мог перестать ждать (например, его задачу отменили)
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class _Job:
+    __slots__ = ("chat_id", "call", "priority", "future", "enqueued_at", "attempts")
+
+    def __init__(self, chat_id, call, priority, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class SendScheduler:
+    """
+    Единая очередь исходящих запросов к Telegram.
+    Запросы выполняются по приоритету (ответы пользователям раньше рассылок) с учётом
+    общего лимита бота и лимита на чат (token bucket). Запрос к чату, исчерпавшему лимит,
+    откладывается, не задерживая остальные чаты; запросы в один чат уходят в порядке постановки.
+    На 429 (RetryAfter) отправка приостанавливается на указанное Telegram время и запрос повторяется.
+    Пока планировщик не запущен, запросы выполняются сразу.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 max_retries=SEND_MAX_RETRIES, max_in_flight=SEND_MAX_IN_FLIGHT):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self._chat_buckets = {}
+        # ID чата -> [asyncio.Lock, число запросов, ожидающих или держащих лок]
+        self._chat_locks = {}
+        self._seq = itertools.count()
+        # Куча (приоритет, номер, запрос) готовых к отправке
+        self._ready = []
+        # Куча (время готовности, приоритет, номер, запрос) ждущих лимита своего чата
+        self._deferred = []
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._in_flight = None
+        self._task = None
+        self._metrics_task = None
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._ready) + len(self._deferred)
+
+    def get_metrics(self):
+        """Глубина очереди и время ожидания отправленных с последнего сброса метрик запросов."""
+        return {
+            "queue_depth": self.queue_depth,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / self.sent if self.sent else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    async def submit(self, chat_id, call, priority=PRIORITY_NORMAL):
+        """
+        Выполняет call() (корутину запроса к Telegram) в свою очередь и возвращает её результат.
+        Исключения запроса (кроме обработанного RetryAfter) пробрасываются вызывающему.
+        """
+        if self._task is None:
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Job(chat_id, call, priority, future))
+        return await future
+
+    def _push(self, job):
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.create_task(self._run())
+        self._metrics_task = asyncio.create_task(self._log_metrics())
+        logger.info(
+            f"Очередь отправки запущена: до {self.global_bucket.rate} запросов/с всего, "
+            f"{self.chat_rate} запросов/с на чат"
+        )
+
+    async def stop(self, timeout=10.0):
+        """Дожидается отправки поставленных запросов (не дольше timeout) и останавливает очередь."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue_depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in (self._task, self._metrics_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._metrics_task = None
+        # Неотправленные запросы выполняем напрямую, чтобы вызывающие не ждали вечно
+        pending = [job for _, _, job in self._ready] + [job for *_, job in self._deferred]
+        self._ready.clear()
+        self._deferred.clear()
+        for job in pending:
+            if not job.future.done():
+                asyncio.create_task(self._call_directly(job))
+        logger.info(f"Очередь отправки остановлена, отправлено напрямую: {len(pending)}")
+
+    async def _call_directly(self, job):
+        try:
+            _resolve(job.future, result=await job.call())
+        except Exception as e:
+            _resolve(job.future, error=e)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            # Запросы, дождавшиеся лимита своего чата, возвращаются в общую очередь
+            while self._deferred and self._deferred[0][0] <= now:
+                _, priority, seq, job = heapq.heappop(self._deferred)
+                heapq.heappush(self._ready, (priority, seq, job))
+
+            if not self._ready:
+                timeout = self._deferred[0][0] - now if self._deferred else None
+                await self._wait(timeout)
+                continue
+
+            wait = max(self._paused_until - now, self.global_bucket.delay(now))
+            if wait > 0:
+                # Пока ждём токен, может прийти запрос важнее - после паузы выбираем заново
+                await asyncio.sleep(wait)
+                continue
+
+            _, seq, job = heapq.heappop(self._ready)
+            chat_bucket = self._chat_bucket(job.chat_id, now)
+            chat_wait = chat_bucket.delay(now)
+            if chat_wait > 0:
+                heapq.heappush(self._deferred, (now + chat_wait, job.priority, seq, job))
+                continue
+
+            self.global_bucket.consume(now)
+            chat_bucket.consume(now)
+            await self._in_flight.acquire()
+            asyncio.create_task(self._send(job, now))
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Полные корзины ничем не отличаются от новых - их можно забыть
+                self._chat_buckets = {
+                    cid: b for cid, b in self._chat_buckets.items() if not b.is_full(now)
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _send(self, job, dispatched_at):
+        entry = self._chat_locks.get(job.chat_id)
+        if entry is None:
+            entry = self._chat_locks[job.chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Запросы в один чат выполняются по одному, в порядке отправки из очереди
+            async with entry[0]:
+                result = await job.call()
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            job.attempts += 1
+            self.retried += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            logger.warning(f"Telegram ограничил отправку (429), пауза {delay} с, попытка {job.attempts}")
+            if job.attempts > self.max_retries:
+                self.failed += 1
+                _resolve(job.future, error=e)
+            else:
+                self._push(job)
+        except Exception as e:
+            self.failed += 1
+            _resolve(job.future, error=e)
+        else:
+            wait = dispatched_at - job.enqueued_at
+            self.sent += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            _resolve(job.future, result=result)
+        finally:
+            self._in_flight.release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[job.chat_id]
+
+    async def _log_metrics(self):
+        while True:
+            await asyncio.sleep(SEND_METRICS_INTERVAL)
+            metrics = self.get_metrics()
+            if metrics["sent"] or metrics["queue_depth"] or metrics["failed"]:
+                logger.info(
+                    f"Очередь отправки: в очереди {metrics['queue_depth']}, отправлено {metrics['sent']}, "
+                    f"ожидание среднее {metrics['wait_avg']:.2f} с / макс {metrics['wait_max']:.2f} с, "
+                    f"повторов после 429: {metrics['retried']}, ошибок: {metrics['failed']}"
+                )
+            self._reset_metrics()
+
+
+# Общий планировщик для всех модулей бота
+scheduler = SendScheduler()
+
+
+async def send_message(bot, chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+    """bot.send_message через очередь отправки."""
+    return await scheduler.submit(
+        chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority
+    )
+
+
+async def start_outbox(app_instance=None):
+    await scheduler.start()
+
+
+async def stop_outbox(app_instance=None):
+    await scheduler.stop()
@@ -0,0 +1,117 @@
+# persistence.py
+
+import asyncio
+import logging
+from constants import PERSIST_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Фоновая запись изменений в хранилище.
+    Обработчики только ставят записи в очередь; раз в PERSIST_INTERVAL секунд все накопленные
+    записи уходят в хранилище одной пачкой (group commit) в отдельном потоке,
+    поэтому дисковый ввод-вывод не блокирует event loop.
+    Пока воркер не запущен (импорт модуля, миграция), записи сохраняются синхронно.
+    """
+
+    def __init__(self, storage, get_snapshot, interval=PERSIST_INTERVAL):
+        self.storage = storage
+        # Возвращает копию (user_names, queues) для полного снимка
+        self.get_snapshot = get_snapshot
+        self.interval = interval
+        self._pending = []
+        self._snapshot_requested = False
+        self._dirty = None
+        self._lock = None
+        self._task = None
+
+    def submit(self, record):
+        """Ставит запись (op, args) в очередь на сохранение."""
+        if self._task is None:
+            self.storage.append([record])
+            if self.storage.needs_snapshot():
+                self.storage.save_snapshot(*self.get_snapshot())
+            return
+        self._pending.append(record)
+        self._dirty.set()
+
+    def request_snapshot(self):
+        """Запрашивает сохранение полного снимка вместо накопленных записей."""
+        if self._task is None:
+            self.storage.save_snapshot(*self.get_snapshot())
+            return
+        self._snapshot_requested = True
+        self._dirty.set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Фоновая запись данных запущена (интервал {self.interval} с)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Воркер отменяется только между записями: если отменить его посреди asyncio.to_thread,
+        # поток продолжит писать, а последняя запись ниже пойдёт в хранилище одновременно с ним
+        async with self._lock:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            await self._write_pending()
+        self._task = None
+        logger.info("Фоновая запись данных остановлена, все изменения сохранены")
+
+    async def flush(self):
+        """Немедленно сохраняет все изменения, поставленные в очередь до вызова."""
+        if self._task is None:
+            return
+        async with self._lock:
+            await self._write_pending()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            # Даём накопиться пачке изменений, чтобы записать их одной операцией
+            await asyncio.sleep(self.interval)
+            self._dirty.clear()
+            async with self._lock:
+                await self._write_pending()
+
+    async def _write_pending(self):
+        records, self._pending = self._pending, []
+        snapshot = None
+        if self._snapshot_requested:
+            # Снимок уже включает все накопленные записи - отдельно их писать не нужно
+            self._snapshot_requested = False
+            snapshot = self.get_snapshot()
+            records = []
+        if snapshot is None and not records:
+            return
+
+        try:
+            if snapshot is not None:
+                await asyncio.to_thread(self.storage.save_snapshot, *snapshot)
+                logger.info("Снимок данных сохранён в хранилище")
+            else:
+                await asyncio.to_thread(self.storage.append, records)
+                logger.debug(f"Сохранено {len(records)} изменений одной пачкой")
+        except Exception as e:
+            logger.error(f"Ошибка фоновой записи данных, повторим позже: {e}")
+            if snapshot is not None:
+                self._snapshot_requested = True
+            else:
+                self._pending[:0] = records
+            self._dirty.set()
+            return
+
+        if self.storage.needs_snapshot():
+            logger.info("Журнал операций достиг порога, выполняю компактификацию.")
+            self._snapshot_requested = True
+            self._dirty.set()
@@ -0,0 +1,196 @@
+# queue_store.py
+
+import random
+
+
+class _Node:
+    __slots__ = ("user_id", "priority", "left", "right", "parent", "size")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left:
+        node.left.parent = node
+    if node.right:
+        node.right.parent = node
+
+
+def _split(node, k):
+    """Делит дерево на первые k элементов и остальные."""
+    if node is None:
+        return None, None
+    node.parent = None
+    if k <= _size(node.left):
+        left, right = _split(node.left, k)
+        node.left = right
+        _update(node)
+        return left, node
+    left, right = _split(node.right, k - _size(node.left) - 1)
+    node.right = left
+    _update(node)
+    return node, right
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+class QueueStore:
+    """
+    Очередь ID пользователей.
+    Порядок хранится в декартовом дереве по неявному ключу (позиции),
+    а словарь ID -> узел даёт проверку "в очереди ли" за O(1).
+    Вставка, удаление, перемещение и поиск позиции - O(log n).
+    version увеличивается при каждом изменении - по нему кешируется отрисовка очереди.
+    """
+
+    def __init__(self, user_ids=()):
+        self._root = None
+        self._nodes = {}
+        self.version = 0
+        for user_id in user_ids:
+            self.append(user_id)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, user_id):
+        return user_id in self._nodes
+
+    def __iter__(self):
+        stack = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.user_id
+            node = node.right
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("QueueStore index out of range")
+        node = self._root
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.user_id
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    def slice(self, start, stop):
+        """Список ID на позициях [start, stop) за O(log n + длина среза)."""
+        start = max(0, start)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+        # Спускаемся к узлу start; в стеке остаются предки, следующие за ним по порядку
+        stack = []
+        node = self._root
+        k = start
+        while node:
+            left_size = _size(node.left)
+            if k < left_size:
+                stack.append(node)
+                node = node.left
+            elif k == left_size:
+                stack.append(node)
+                break
+            else:
+                k -= left_size + 1
+                node = node.right
+
+        result = []
+        while stack and len(result) < stop - start:
+            node = stack.pop()
+            result.append(node.user_id)
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+        return result
+
+    def __repr__(self):
+        return f"QueueStore({list(self)!r})"
+
+    def append(self, user_id):
+        self.insert(len(self), user_id)
+
+    def insert(self, index, user_id):
+        """Вставляет пользователя на позицию index (0 - в начало)."""
+        if user_id in self._nodes:
+            raise ValueError(f"{user_id} уже в очереди")
+        index = max(0, min(index, len(self)))
+        node = _Node(user_id)
+        self._nodes[user_id] = node
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, node), right)
+        self._root.parent = None
+        self.version += 1
+
+    def remove(self, user_id):
+        node = self._nodes.pop(user_id)
+        subtree = _merge(node.left, node.right)
+        parent = node.parent
+        if subtree:
+            subtree.parent = parent
+        if parent is None:
+            self._root = subtree
+        elif parent.left is node:
+            parent.left = subtree
+        else:
+            parent.right = subtree
+        while parent:
+            parent.size -= 1
+            parent = parent.parent
+        self.version += 1
+
+    def discard(self, user_id):
+        if user_id in self._nodes:
+            self.remove(user_id)
+
+    def touch(self):
+        """Отмечает очередь изменённой (например, когда сменилось имя стоящего в ней)."""
+        self.version += 1
+
+    def move(self, user_id, index):
+        self.remove(user_id)
+        self.insert(index, user_id)
+
+    def index(self, user_id):
+        """Позиция пользователя в очереди, начиная с 0."""
+        node = self._nodes[user_id]
+        rank = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                rank += _size(node.parent.left) + 1
+            node = node.parent
+        return rank
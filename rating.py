@@ -1,28 +1,200 @@
 # rating.py
 
+import asyncio
+import hashlib
+import importlib.util
 import logging
-import requests
 import tempfile
 import os
-from pathlib import Path
+import random
+import zipfile
+from xml.etree.ElementTree import iterparse
 import pickle
+from array import array
+
+import httpx
 
 from odf.opendocument import load
 from odf.table import Table, TableCell
 from odf.text import P
+from openpyxl import load_workbook
+
+from constants import SUBJECTS
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
 YANDEX_DISK_LINK = 'https://disk.yandex.ru/d/2CxHh12B72bOcg  '
-TARGET_FILE_NAME = '2025-2026 ЛР.ods'
+# Адрес API Яндекс.Диска (можно подменить локальной заглушкой для проверки)
+YANDEX_API_URL = os.getenv("YANDEX_API_URL", "https://cloud-api.yandex.net")
+TARGET_FILE_NAME = '2025-2026 ЛР.ods'  # Подходит и книга с тем же именем в другом формате (например, .xlsx)
 SHEET_NAME = '25КБ-1 ЯП'
-RATING_FILE = 'rating_cache.db'  # Кеш рейтинга
+# Какой лист книги содержит рейтинг какого предмета: {предмет: лист}
+RATING_SHEETS = {subject: f'25КБ-1 {subject}' for subject in SUBJECTS}
+RATING_FILE = 'rating_cache.db'  # Старый кеш рейтинга одним файлом (переносится в RATING_CACHE_DIR)
+RATING_CACHE_DIR = 'rating_cache'  # Кеш рейтинга: по файлу на предмет
+RATING_PAGE_SIZE = 27  # Строк на странице рейтинга (укладывается в лимит сообщения с HTML)
+RATING_HTTP_TIMEOUT = 60  # Таймаут запросов к Яндекс.Диску (секунды)
+RATING_HTTP_CONNECT_TIMEOUT = 10  # Таймаут установки соединения (секунды)
+RATING_HTTP_KEEPALIVE = 5 * 60  # Сколько держать простаивающее соединение открытым (секунды)
+RATING_HTTP_RETRIES = 3  # Повторов запроса при 5xx/429 и сетевых сбоях
+RATING_HTTP_BACKOFF = 1.0  # Пауза перед первым повтором (секунды), дальше удваивается
+RATING_HTTP_BACKOFF_MAX = 30  # Предел паузы между повторами (секунды), в том числе по Retry-After
+RATING_SPOOL_THRESHOLD = 16 * 1024 * 1024  # Книга до этого размера (байт) скачивается в память, больше - во временный файл
+RATING_DOWNLOAD_CHUNK = 64 * 1024  # Размер куска при потоковом скачивании (байт)
+RATING_REFRESH_INTERVAL = 30 * 60  # Период автообновления рейтинга (секунды)
+RATING_REFRESH_FIRST_DELAY = 60  # Первое автообновление после запуска бота (секунды)
+RATING_REFRESH_JITTER = 0.1  # Случайный разброс периода автообновления (доля периода)
+RATING_REFRESH_RETRY = 60  # Пауза после неудачного автообновления; удваивается до RATING_REFRESH_INTERVAL
 
-# Словарь для хранения рейтинга в памяти
+# Словарь для хранения рейтинга в памяти (предметы подгружаются из кеша при первом обращении)
 # Структура: {предмет: {имя: баллы}}
 ratings = {}
+# Таблицы мест, построенные один раз при обновлении или загрузке рейтинга
+# Структура: {предмет: RankTable}
+rank_tables = {}
+# Изменения рейтинга, внесённые последним обновлением: {предмет: RatingDelta}
+last_rating_deltas = {}
+# Функции listener(deltas), которые вызываются после обновления, изменившего рейтинг;
+# deltas - {предмет: RatingDelta}
+rating_listeners = []
+# Отпечатки файлов Яндекс.Диска, из которых получен рейтинг (хранятся в кеше вместе с ним).
+# Структура: {имя файла: {'fingerprint': (md5, size, modified), 'subjects': [предметы]}}
+source_fingerprints = {}
+
+
+class RankTable:
+    """
+    Неизменяемая таблица мест рейтинга предмета.
+    entries - кортеж (место, имя, баллы) по убыванию баллов; при равных баллах место общее,
+    следующее место пропускается (1, 2, 2, 4). Место по имени - O(1), топ-k - O(k).
+    """
+
+    __slots__ = ("entries", "ranks")
+
+    def __init__(self, rating_data):
+        # sorted устойчив: при равных баллах сохраняется порядок из таблицы
+        ordered = sorted(rating_data.items(), key=lambda item: item[1], reverse=True)
+        entries = []
+        rank = 0
+        previous_score = None
+        for position, (name, score) in enumerate(ordered, start=1):
+            if score != previous_score:
+                rank = position
+                previous_score = score
+            entries.append((rank, name, score))
+        self.entries = tuple(entries)
+        self.ranks = {name: rank for rank, name, _ in entries}
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Таблица из уже упорядоченных записей (место, имя, баллы), например из кеша."""
+        table = cls.__new__(cls)
+        table.entries = tuple(entries)
+        table.ranks = {name: rank for rank, name, _ in table.entries}
+        return table
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rank(self, name):
+        return self.ranks.get(name)
+
+    def top(self, limit):
+        return self.entries[:limit]
+
+
+class RenderedRating:
+    """Готовые HTML-сообщения рейтинга предмета: страницы полного списка и топ-10."""
+
+    __slots__ = ("digest", "pages", "top")
+
+    def __init__(self, digest, pages, top):
+        self.digest = digest
+        self.pages = pages
+        self.top = top
+
+
+# Отрисованные сообщения рейтинга, пересобираются только при изменении содержимого
+# Структура: {предмет: RenderedRating}
+rendered_ratings = {}
+
+
+def _medal(rank):
+    return "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"{rank}."
+
+
+def _render_rating(subject):
+    """Отрисовывает страницы рейтинга, если содержимое таблицы мест изменилось."""
+    table = rank_tables[subject]
+    digest = hashlib.sha256(repr(table.entries).encode()).hexdigest()
+    cached = rendered_ratings.get(subject)
+    if cached is not None and cached.digest == digest:
+        return cached
+
+    # Полный список показывает только фамилии
+    lines = [f"{_medal(rank)} <b>{name.split()[0]}</b> — {score:.2f} лаб" for rank, name, score in table.entries]
+    page_count = max(1, -(-len(lines) // RATING_PAGE_SIZE))
+    pages = []
+    for page in range(page_count):
+        header = f"📊 <b>Рейтинг по {subject}:</b>"
+        if page_count > 1:
+            header += f" ({page + 1}/{page_count})"
+        body = "\n".join(lines[page * RATING_PAGE_SIZE:(page + 1) * RATING_PAGE_SIZE])
+        pages.append(f"{header}\n\n{body}\n")
+
+    top_lines = [f"{_medal(rank)} <b>{name}</b> — {score:.2f} лаб" for rank, name, score in table.top(10)]
+    top = f"📊 <b>Топ рейтинга по {subject}:</b>\n\n" + "\n".join(top_lines) + "\n"
+
+    rendered = rendered_ratings[subject] = RenderedRating(digest, tuple(pages), top)
+    logger.info(f"[RATING] Рейтинг по '{subject}' отрисован: {page_count} страниц")
+    return rendered
+
+
+class RatingDelta:
+    """
+    Изменения рейтинга предмета между двумя таблицами мест.
+    Каждый список - кортежи (имя, старое место, старые баллы, новое место, новые баллы),
+    для появившихся старые значения None, для выбывших - новые.
+    rank_moved - только те, у кого место сменилось при прежних баллах.
+    initial - прежнего рейтинга не было (все студенты в added).
+    """
+
+    __slots__ = ("added", "removed", "score_changed", "rank_moved", "initial")
+
+    def __init__(self, initial=False):
+        self.added = []
+        self.removed = []
+        self.score_changed = []
+        self.rank_moved = []
+        self.initial = initial
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.score_changed or self.rank_moved)
+
+    def changes(self):
+        """Все изменения подряд (имя и старые/новые место и баллы)."""
+        return self.added + self.removed + self.score_changed + self.rank_moved
+
+
+def diff_rank_tables(old, new):
+    """Сравнивает две таблицы мест (old может быть None) по именам за O(n); возвращает RatingDelta."""
+    delta = RatingDelta(initial=old is None)
+    previous = {} if old is None else {name: (rank, score) for rank, name, score in old.entries}
+    for rank, name, score in new.entries:
+        old_entry = previous.pop(name, None)
+        if old_entry is None:
+            delta.added.append((name, None, None, rank, score))
+            continue
+        old_rank, old_score = old_entry
+        if score != old_score:
+            delta.score_changed.append((name, old_rank, old_score, rank, score))
+        elif rank != old_rank:
+            delta.rank_moved.append((name, old_rank, old_score, rank, score))
+    # Оставшиеся в previous из нового рейтинга выбыли
+    delta.removed.extend((name, rank, score, None, None) for name, (rank, score) in previous.items())
+    return delta
 
 def get_cell_text(cell):
     """Извлекает текст из ячейки ODS."""
@@ -34,18 +206,104 @@ def get_cell_text(cell):
                 text.append(node.data)
     return ''.join(text).strip()
 
-def download_file_from_yandex(public_link):
-    """Скачивает файл с Яндекс.Диска по публичной ссылке на папку."""
+async def _report(progress, text):
+    """Передаёт текст прогресса обновления вызывающему (если он передал progress)."""
+    if progress is None:
+        return
+    try:
+        await progress(text)
+    except Exception as e:
+        logger.warning(f"[RATING] Не удалось показать прогресс обновления: {e}")
+
+def _item_fingerprint(item):
+    """Отпечаток файла из метаданных списка папки или None, если API их не вернул."""
+    fingerprint = (item.get('md5'), item.get('size'), item.get('modified'))
+    if fingerprint[0] is None and fingerprint[2] is None:
+        return None
+    return fingerprint
+
+# --- HTTP-клиент Яндекс.Диска ---
+# Один долгоживущий клиент на модуль: соединения переиспользуются между запросами и обновлениями
+_http_client = None
+# HTTP/2 включается, только если установлен пакет h2 (httpx[http2])
+_HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+def get_http_client():
+    """Возвращает общий httpx.AsyncClient модуля, создавая его при первом обращении."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(RATING_HTTP_TIMEOUT, connect=RATING_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=4, keepalive_expiry=RATING_HTTP_KEEPALIVE),
+            follow_redirects=True,
+        )
+        logger.info(f"[RATING] HTTP-клиент создан (HTTP/2: {'да' if _HTTP2_AVAILABLE else 'нет'})")
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+async def _send_with_retries(method, url, stream=False, **kwargs):
+    """
+    Выполняет запрос общим клиентом. При 5xx/429 и сетевых сбоях повторяет его не больше
+    RATING_HTTP_RETRIES раз с удваивающейся паузой (или по Retry-After), остальные ошибки
+    HTTP пробрасывает сразу (httpx.HTTPStatusError).
+    При stream=True тело не читается - ответ должен закрыть вызывающий (aclose).
+    """
+    client = get_http_client()
+    request = client.build_request(method, url, **kwargs)
+    for attempt in range(RATING_HTTP_RETRIES + 1):
+        last_attempt = attempt == RATING_HTTP_RETRIES
+        delay = min(RATING_HTTP_BACKOFF * 2 ** attempt, RATING_HTTP_BACKOFF_MAX)
+        try:
+            response = await client.send(request, stream=stream)
+        except httpx.TransportError as e:
+            if last_attempt:
+                raise
+            reason = f"{type(e).__name__}: {e}"
+        else:
+            if last_attempt or not _is_retryable(response.status_code):
+                try:
+                    response.raise_for_status()
+                except httpx.HTTPStatusError:
+                    await response.aclose()
+                    raise
+                return response
+            await response.aclose()
+            reason = f"HTTP {response.status_code}"
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = min(float(retry_after), RATING_HTTP_BACKOFF_MAX)
+        logger.warning(f"[RATING] {method} {request.url.host}: {reason}, повтор {attempt + 1}/{RATING_HTTP_RETRIES} через {delay:.1f} с")
+        await asyncio.sleep(delay)
+
+async def download_file_from_yandex(public_link, progress=None, known_fingerprint=None):
+    """
+    Скачивает файл с Яндекс.Диска по публичной ссылке на папку (не блокируя event loop).
+    Файл скачивается потоком в SpooledTemporaryFile: до RATING_SPOOL_THRESHOLD байт он остаётся
+    в памяти, больше - переносится в безымянный временный файл. Закрыть его должен вызывающий.
+    Если отпечаток файла (md5, размер, время изменения) совпадает с known_fingerprint,
+    файл не скачивается.
+    
+    Возвращает (файл, отпечаток); (None, отпечаток) - файл не изменился; (None, None) - ошибка
+    """
     logger.info(f"[RATING] Попытка скачать файл {TARGET_FILE_NAME} из папки: {public_link}")
     
     try:
         # URL для получения содержимого публичной папки
-        resource_url = 'https://cloud-api.yandex.net/v1/disk/public/resources'
+        resource_url = f'{YANDEX_API_URL}/v1/disk/public/resources'
         headers = {'Accept': 'application/json'}
         params = {'public_key': public_link.strip()}
 
-        response = requests.get(resource_url, headers=headers, params=params)
-        response.raise_for_status()
+        await _report(progress, "⏳ Получаю список файлов на Яндекс.Диске...")
+        response = await _send_with_retries('GET', resource_url, headers=headers, params=params)
         folder_contents = response.json()
 
         # Логируем содержимое папки для отладки
@@ -53,186 +311,745 @@ def download_file_from_yandex(public_link):
 
         # Поиск целевого файла в содержимом папки
         download_url = None
+        fingerprint = None
         if '_embedded' in folder_contents and 'items' in folder_contents['_embedded']:
             for item in folder_contents['_embedded']['items']:
                 logger.debug(f"[RATING] Проверяем файл: {item['name']}")
-                if item['name'] == TARGET_FILE_NAME:
+                if _is_target_file(item['name']):
                     download_url = item['file']  # Прямая ссылка на файл
-                    logger.info(f"[RATING] Найден файл '{TARGET_FILE_NAME}', ссылка: {download_url}")
-                    break
+                    fingerprint = _item_fingerprint(item)
+                    logger.info(f"[RATING] Найден файл '{item['name']}', ссылка: {download_url}")
+                    # Файл с точным именем важнее того же файла в другом формате
+                    if item['name'] == TARGET_FILE_NAME:
+                        break
 
         if not download_url:
             logger.error(f"[RATING] Файл '{TARGET_FILE_NAME}' не найден в папке. Доступные файлы: {list(item['name'] for item in folder_contents.get('_embedded', {}).get('items', []))}")
-            return None
+            return None, None
+
+        # Файл не менялся с прошлого обновления - скачивать и разбирать его заново не нужно
+        if fingerprint is not None and fingerprint == known_fingerprint:
+            logger.info(f"[RATING] Файл '{TARGET_FILE_NAME}' не изменился (md5 {fingerprint[0]}), скачивание пропущено")
+            return None, fingerprint
 
         # Скачивание файла по прямой ссылке
-        response = requests.get(download_url)
-        response.raise_for_status()
+        await _report(progress, f"⏳ Скачиваю {TARGET_FILE_NAME}...")
+        book = tempfile.SpooledTemporaryFile(max_size=RATING_SPOOL_THRESHOLD)
+        try:
+            response = await _send_with_retries('GET', download_url, stream=True)
+            try:
+                async for chunk in response.aiter_bytes(RATING_DOWNLOAD_CHUNK):
+                    book.write(chunk)
+            finally:
+                await response.aclose()
+        except BaseException:
+            book.close()
+            raise
 
-        # Сохраняем во временный файл
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, TARGET_FILE_NAME)
-        
-        with open(temp_file, 'wb') as f:
-            f.write(response.content)
-        
-        logger.info(f"[RATING] Файл успешно скачан: {temp_file}")
-        return temp_file
+        logger.info(f"[RATING] Файл успешно скачан: {book.tell() / 1024:.0f} КБ")
+        book.seek(0)
+        return book, fingerprint
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"[RATING] Ошибка при обращении к API Яндекс.Диска: {e}")
-        return None
+        return None, None
     except KeyError:
         logger.error(f"[RATING] Ошибка: Неожиданный формат ответа от API.")
-        return None
+        return None, None
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logger.error(f"[RATING] Ошибка при скачивании файла: {e}")
-        return None
+        return None, None
 
-def parse_ods_file(file_path, sheet_name, start_row=35):
+def _parse_sheet_rows(sheet, sheet_name, start_row):
+    """Извлекает {имя: баллы} из колонок A-C листа, начиная со строки start_row."""
+    # Извлекаем строки из листа (не через getElementsByType(Table))
+    rows = sheet.childNodes  # Строки находятся как дочерние элементы листа
+    
+    # Логируем количество строк для отладки
+    logger.info(f"[RATING] Найдено {len(rows)} элементов в листе '{sheet_name}'")
+    
+    rating_data = {}
+    
+    for row_idx, row in enumerate(rows[start_row - 1:], start=start_row):
+        # Проверяем, что элемент - это строка таблицы
+        if row.qname[1] != 'table-row':  # qname[1] содержит имя тега
+            continue
+        
+        cells = row.getElementsByType(TableCell)
+        
+        # Логируем количество ячеек в строке
+        logger.debug(f"[RATING] Строка {row_idx}: {len(cells)} ячеек")
+        
+        if len(cells) < 3:  # Нужны минимум колонки A, B, C
+            continue
+        
+        # Извлекаем текст из ячеек
+        a_text = get_cell_text(cells[0])
+        b_text = get_cell_text(cells[1])
+        c_text = get_cell_text(cells[2]) if len(cells) > 2 else ''
+        _add_rating_row(rating_data, a_text, b_text, c_text)
+    
+    logger.info(f"[RATING] Загружено {len(rating_data)} студентов из '{sheet_name}'")
+    return rating_data
+
+def _add_rating_row(rating_data, a_text, b_text, c_text):
+    """Добавляет в rating_data строку с колонками A (номер), B (ФИО), C (баллы), если это строка студента."""
+    logger.debug(f"[RATING] A={a_text}, B={b_text}, C={c_text}")
+    
+    # Пропускаем пустые строки и строку заголовка
+    if not a_text or a_text.strip() == 'итого':
+        return
+    
+    # Пропускаем строку заголовка
+    if not b_text or b_text == 'ФИО':
+        return
+    
+    try:
+        if c_text:
+            score = float(c_text.replace(',', '.'))
+            rating_data[b_text] = score
+            logger.debug(f"[RATING] Найден: {b_text} = {score}")
+    except (ValueError, AttributeError):
+        logger.warning(f"[RATING] Не удалось распарсить оценку для {b_text}: {c_text}")
+
+# --- Потоковый разбор ODS ---
+# ODS - zip-архив, данные всех листов лежат в content.xml. Вместо построения DOM всей книги
+# читаем content.xml потоком (iterparse): строки разбираются по мере чтения и сразу удаляются
+# из дерева, из строки берутся только первые три ячейки, а после последнего нужного листа
+# чтение прекращается.
+_TABLE_NS = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+_TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+_TABLE = _TABLE_NS + 'table'
+_TABLE_ROW = _TABLE_NS + 'table-row'
+_TABLE_CELLS = (_TABLE_NS + 'table-cell', _TABLE_NS + 'covered-table-cell')
+_TABLE_NAME = _TABLE_NS + 'name'
+_ROWS_REPEATED = _TABLE_NS + 'number-rows-repeated'
+_COLUMNS_REPEATED = _TABLE_NS + 'number-columns-repeated'
+_TEXT_P = _TEXT_NS + 'p'
+
+def _stream_cell_text(cell):
+    return ''.join(''.join(p.itertext()) for p in cell.iter(_TEXT_P)).strip()
+
+def _stream_row_cells(row, count=3):
+    """Тексты первых count ячеек строки; повторы ячеек (number-columns-repeated) раскрываются лениво."""
+    texts = []
+    for cell in row:
+        if cell.tag not in _TABLE_CELLS:
+            continue
+        text = _stream_cell_text(cell)
+        repeated = int(cell.get(_COLUMNS_REPEATED, 1))
+        texts.extend([text] * min(repeated, count - len(texts)))
+        if len(texts) >= count:
+            break
+    return texts
+
+def parse_ods_sheets(file_path, sheet_names, start_row=35):
     """
-    Парсит ODS файл и извлекает данные.
-    start_row: строка, с которой начинаются данные (по умолчанию 35 в изображении)
+    Парсит несколько листов ODS файла за один потоковый проход по content.xml.
+    file_path - путь к файлу или открытый двоичный файл (например, скачанный в память).
+    start_row - номер строки листа (с учётом повторяющихся строк), с которой начинаются данные.
+    Возвращает словарь: {лист: {имя: баллы}}; ненайденные листы в него не попадают.
+    """
+    logger.info(f"[RATING] Потоковый парсинг файла {file_path}, листы {list(sheet_names)}")
+    wanted = set(sheet_names)
     
-    Возвращает словарь: {имя: баллы}
+    try:
+        results = {}
+        available_sheets = []
+        with zipfile.ZipFile(file_path) as archive, archive.open('content.xml') as content:
+            # Стек открытых элементов нужен, чтобы удалять разобранные строки из родителя
+            stack = []
+            sheet_data = None
+            sheet_name = None
+            row_number = 1
+            for event, elem in iterparse(content, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    if elem.tag == _TABLE:
+                        sheet_name = elem.get(_TABLE_NAME)
+                        available_sheets.append(sheet_name)
+                        sheet_data = {} if sheet_name in wanted and sheet_name not in results else None
+                        row_number = 1
+                    continue
+                
+                stack.pop()
+                if elem.tag == _TABLE_ROW:
+                    repeated = int(elem.get(_ROWS_REPEATED, 1))
+                    # Строки ненужных листов и строки до start_row не разбираются
+                    if sheet_data is not None and row_number + repeated > start_row:
+                        cells = _stream_row_cells(elem)
+                        # Повторы строки одинаковы - достаточно обработать её один раз
+                        if len(cells) == 3:
+                            _add_rating_row(sheet_data, *cells)
+                    row_number += repeated
+                    if stack:
+                        stack[-1].remove(elem)
+                elif elem.tag == _TABLE:
+                    if sheet_data is not None:
+                        results[sheet_name] = sheet_data
+                        logger.info(f"[RATING] Загружено {len(sheet_data)} студентов из '{sheet_name}'")
+                    sheet_data = None
+                    if stack:
+                        stack[-1].remove(elem)
+                    if len(results) == len(wanted):
+                        # Остальные листы не нужны - дальше не читаем
+                        break
+        
+        missing = wanted - results.keys()
+        if missing:
+            logger.error(f"[RATING] Листы {sorted(missing)} не найдены в файле. Доступные листы: {available_sheets}")
+        return results
+    
+    except Exception as e:
+        logger.error(f"[RATING] Ошибка при парсинге ODS: {e}")
+        return {}
+
+def parse_ods_sheets_odfpy(file_path, sheet_names, start_row=35):
+    """
+    Парсит несколько листов ODS файла через odfpy (DOM всей книги).
+    Медленнее и требует больше памяти, чем parse_ods_sheets; оставлен для сравнения в bench_rating.py.
+    Возвращает словарь: {лист: {имя: баллы}}; ненайденные листы в него не попадают.
     """
-    logger.info(f"[RATING] Парсинг файла {file_path}, лист '{sheet_name}'")
+    logger.info(f"[RATING] Парсинг файла {file_path}, листы {list(sheet_names)}")
+    wanted = set(sheet_names)
     
     try:
         doc = load(file_path)
         
-        # Находим нужный лист
-        sheet = None
+        results = {}
         available_sheets = []
         for table_elem in doc.spreadsheet.getElementsByType(Table):
             sheet_name_attr = table_elem.getAttribute('name')
             available_sheets.append(sheet_name_attr)
-            if sheet_name_attr == sheet_name:
-                sheet = table_elem
-                break
-        
-        if not sheet:
-            logger.error(f"[RATING] Лист '{sheet_name}' не найден в файле. Доступные листы: {available_sheets}")
-            return {}
-        
-        # Извлекаем строки из листа (не через getElementsByType(Table))
-        rows = sheet.childNodes  # Строки находятся как дочерние элементы листа
-        
-        # Логируем количество строк для отладки
-        logger.info(f"[RATING] Найдено {len(rows)} элементов в листе '{sheet_name}'")
-        
-        rating_data = {}
-        
-        for row_idx, row in enumerate(rows[start_row - 1:], start=start_row):
-            # Проверяем, что элемент - это строка таблицы
-            if row.qname[1] != 'table-row':  # qname[1] содержит имя тега
-                continue
-            
-            cells = row.getElementsByType(TableCell)
-            
-            # Логируем количество ячеек в строке
-            logger.debug(f"[RATING] Строка {row_idx}: {len(cells)} ячеек")
-            
-            if len(cells) < 3:  # Нужны минимум колонки A, B, C
-                continue
-            
-            # Извлекаем текст из ячеек
-            a_text = get_cell_text(cells[0])
-            b_text = get_cell_text(cells[1])
-            c_text = get_cell_text(cells[2]) if len(cells) > 2 else ''
-            
-            logger.debug(f"[RATING] A={a_text}, B={b_text}, C={c_text}")
-            
-            # Пропускаем пустые строки и строку заголовка
-            if not a_text or a_text.strip() == 'итого':
-                continue
-            
-            # Пропускаем строку заголовка
-            if not b_text or b_text == 'ФИО':
-                continue
-            
-            try:
-                if c_text:
-                    score = float(c_text.replace(',', '.'))
-                    rating_data[b_text] = score
-                    logger.debug(f"[RATING] Найден: {b_text} = {score}")
-            except (ValueError, AttributeError):
-                logger.warning(f"[RATING] Не удалось распарсить оценку для {b_text}: {c_text}")
-                continue
+            if sheet_name_attr in wanted and sheet_name_attr not in results:
+                results[sheet_name_attr] = _parse_sheet_rows(table_elem, sheet_name_attr, start_row)
+                if len(results) == len(wanted):
+                    break
         
-        logger.info(f"[RATING] Загружено {len(rating_data)} студентов из '{sheet_name}'")
-        return rating_data
+        missing = wanted - results.keys()
+        if missing:
+            logger.error(f"[RATING] Листы {sorted(missing)} не найдены в файле. Доступные листы: {available_sheets}")
+        return results
     
     except Exception as e:
         logger.error(f"[RATING] Ошибка при парсинге ODS: {e}")
         return {}
 
-def save_rating_to_cache(rating_data, subject):
-    """Сохраняет рейтинг в кеш."""
+def _xlsx_cell_text(value):
+    """Значение ячейки XLSX как текст ячейки ODS, чтобы к строкам применялись те же правила."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def parse_xlsx_sheets(file_path, sheet_names, start_row=35):
+    """
+    Парсит несколько листов XLSX файла через openpyxl в режиме read_only:
+    строки читаются потоком, из каждой берутся только значения колонок A-C.
+    file_path - путь к файлу или открытый двоичный файл.
+    Возвращает словарь: {лист: {имя: баллы}}; ненайденные листы в него не попадают.
+    """
+    logger.info(f"[RATING] Парсинг XLSX файла {file_path}, листы {list(sheet_names)}")
+    
     try:
-        global ratings
-        ratings[subject] = rating_data
-        
-        with open(RATING_FILE, 'wb') as f:
-            pickle.dump(ratings, f)
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            results = {}
+            for sheet_name in sheet_names:
+                if sheet_name not in workbook.sheetnames or sheet_name in results:
+                    continue
+                rating_data = {}
+                for row in workbook[sheet_name].iter_rows(min_row=start_row, max_col=3, values_only=True):
+                    cells = [_xlsx_cell_text(value) for value in row]
+                    if len(cells) < 3:  # Нужны колонки A, B, C
+                        continue
+                    _add_rating_row(rating_data, *cells)
+                results[sheet_name] = rating_data
+                logger.info(f"[RATING] Загружено {len(rating_data)} студентов из '{sheet_name}'")
+            available_sheets = workbook.sheetnames
+        finally:
+            # В режиме read_only книга держит файл открытым до close()
+            workbook.close()
         
-        logger.info(f"[RATING] Рейтинг для '{subject}' сохранен в кеш")
+        missing = set(sheet_names) - results.keys()
+        if missing:
+            logger.error(f"[RATING] Листы {sorted(missing)} не найдены в файле. Доступные листы: {available_sheets}")
+        return results
+    
+    except Exception as e:
+        logger.error(f"[RATING] Ошибка при парсинге XLSX: {e}")
+        return {}
+
+# --- Выбор парсера по формату книги ---
+# Формат -> parse(file_path, sheet_names, start_row) -> {лист: {имя: баллы}}.
+# Новый формат - это функция с той же сигнатурой и её расширения в SPREADSHEET_EXTENSIONS.
+SPREADSHEET_BACKENDS = {
+    'ods': parse_ods_sheets,
+    'xlsx': parse_xlsx_sheets,
+}
+SPREADSHEET_EXTENSIONS = {'.ods': 'ods', '.xlsx': 'xlsx', '.xlsm': 'xlsx'}
+_ODS_MIMETYPE = b'application/vnd.oasis.opendocument.spreadsheet'
+
+def _is_target_file(name):
+    """Книга рейтинга: TARGET_FILE_NAME или файл с тем же именем в другом поддерживаемом формате."""
+    stem, extension = os.path.splitext(name)
+    return name == TARGET_FILE_NAME or (
+        stem == os.path.splitext(TARGET_FILE_NAME)[0] and extension.lower() in SPREADSHEET_EXTENSIONS
+    )
+
+def detect_spreadsheet_format(source, file_name=None):
+    """
+    Определяет формат книги ('ods', 'xlsx') по расширению file_name (или пути source),
+    а если расширение не подсказывает - по содержимому: оба формата - zip-архивы, ODS
+    начинается с файла mimetype, в XLSX есть xl/workbook.xml. Возвращает None, если формат неизвестен.
+    """
+    if file_name is None and isinstance(source, (str, os.PathLike)):
+        file_name = os.fspath(source)
+    if file_name:
+        spreadsheet_format = SPREADSHEET_EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+        if spreadsheet_format:
+            return spreadsheet_format
+    
+    position = source.tell() if hasattr(source, 'read') else None
+    try:
+        with zipfile.ZipFile(source) as archive:
+            names = set(archive.namelist())
+            if 'mimetype' in names and archive.read('mimetype').strip() == _ODS_MIMETYPE:
+                return 'ods'
+            if 'xl/workbook.xml' in names:
+                return 'xlsx'
+    except (zipfile.BadZipFile, OSError):
+        pass
+    finally:
+        # Открытый файл возвращаем туда, откуда его будет читать парсер
+        if position is not None:
+            source.seek(position)
+    return None
+
+def parse_spreadsheet(file_path, sheet_names, start_row=35, file_name=None):
+    """
+    Парсит листы книги парсером её формата (см. SPREADSHEET_BACKENDS).
+    file_name - имя файла для определения формата, если file_path - открытый файл.
+    Возвращает словарь: {лист: {имя: баллы}}
+    """
+    spreadsheet_format = detect_spreadsheet_format(file_path, file_name)
+    if spreadsheet_format is None:
+        logger.error(f"[RATING] Неизвестный формат книги {file_name or file_path}")
+        return {}
+    logger.info(f"[RATING] Формат книги: {spreadsheet_format}")
+    return SPREADSHEET_BACKENDS[spreadsheet_format](file_path, sheet_names, start_row)
+
+def _parse_downloaded_book(book, sheet_names):
+    """Разбирает скачанную книгу и закрывает её (вместе с временным файлом, если он был)."""
+    with book:
+        return parse_spreadsheet(book, sheet_names)
+
+def parse_ods_file(file_path, sheet_name, start_row=35):
+    """
+    Парсит файл рейтинга (ODS или XLSX, формат определяется автоматически) и извлекает данные.
+    start_row: строка, с которой начинаются данные (по умолчанию 35 в изображении)
+    
+    Возвращает словарь: {имя: баллы}
+    """
+    return parse_spreadsheet(file_path, [sheet_name], start_row).get(sheet_name, {})
+
+# --- Кеш рейтинга на диске ---
+# В RATING_CACHE_DIR лежит по файлу на предмет и файл с отпечатками книг.
+# Файл предмета - pickle {'version', 'subject', 'names', 'scores', 'ranks'}: имена в порядке мест,
+# баллы и места - массивы array, то есть готовая таблица мест, которую не нужно пересортировывать.
+# Предмет читается с диска при первом обращении к нему, а обновление перезаписывает
+# только предметы, рейтинг которых изменился. Файлы подменяются атомарно.
+RATING_CACHE_VERSION = 1
+_SOURCES_FILE = 'sources.pickle'
+# Предметы, которые уже читались с диска (или были обновлены до первого обращения)
+_loaded_subjects = set()
+
+def _subject_cache_path(subject):
+    return os.path.join(RATING_CACHE_DIR, subject.replace(os.sep, '_') + '.pickle')
+
+def _write_cache_file(path, payload):
+    """Пишет pickle во временный файл и атомарно подменяет им path."""
+    os.makedirs(RATING_CACHE_DIR, exist_ok=True)
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+def _subject_cache_write(subject):
+    """(путь, содержимое) файла кеша предмета по его текущей таблице мест."""
+    entries = rank_tables[subject].entries
+    return _subject_cache_path(subject), {
+        'version': RATING_CACHE_VERSION,
+        'subject': subject,
+        'names': tuple(name for _, name, _ in entries),
+        'scores': array('d', (score for _, _, score in entries)),
+        'ranks': array('I', (rank for rank, _, _ in entries)),
+    }
+
+def _sources_cache_write():
+    """(путь, содержимое) файла отпечатков книг; копия, т.к. _load_subject меняет списки предметов."""
+    fingerprints = {name: dict(source, subjects=list(source['subjects'])) for name, source in source_fingerprints.items()}
+    return os.path.join(RATING_CACHE_DIR, _SOURCES_FILE), {
+        'version': RATING_CACHE_VERSION,
+        'fingerprints': fingerprints,
+    }
+
+def _write_cache_files(writes):
+    for path, payload in writes:
+        _write_cache_file(path, payload)
+
+def _load_subject(subject):
+    """Читает рейтинг предмета из кеша при первом обращении к нему."""
+    if subject in _loaded_subjects:
+        return
+    _loaded_subjects.add(subject)
+    path = _subject_cache_path(subject)
+    try:
+        with open(path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') != RATING_CACHE_VERSION or cached.get('subject') != subject:
+            raise ValueError(f"версия {cached.get('version')}, ожидалась {RATING_CACHE_VERSION}")
+        entries = tuple(zip(cached['ranks'], cached['names'], cached['scores']))
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"[RATING] Кеш рейтинга '{subject}' не прочитан ({e}), он будет скачан заново")
+        # Отпечаток книги не должен помешать скачать этот предмет при следующем обновлении
+        for source in source_fingerprints.values():
+            if subject in source['subjects']:
+                source['subjects'].remove(subject)
+        return
+    
+    rank_tables[subject] = RankTable.from_entries(entries)
+    ratings[subject] = {name: score for _, name, score in entries}
+    _render_rating(subject)
+    logger.info(f"[RATING] Рейтинг '{subject}' загружен из кеша: {len(entries)} студентов")
+
+def _apply_ratings(results, source):
+    """
+    Обновляет рейтинги в памяти. Возвращает изменения {предмет: RatingDelta} и
+    список (путь, содержимое) файлов кеша, которые нужно записать для изменившихся предметов.
+    Вызывается в event loop: там же геттеры лениво читают предметы через _load_subject.
+    """
+    deltas = {}
+    writes = []
+    for subject, rating_data in results.items():
+        _load_subject(subject)
+        if ratings.get(subject) == rating_data:
+            continue
+        table = RankTable(rating_data)
+        deltas[subject] = diff_rank_tables(rank_tables.get(subject), table)
+        ratings[subject] = rating_data
+        rank_tables[subject] = table
+        _render_rating(subject)
+        writes.append(_subject_cache_write(subject))
+    if source:
+        source_fingerprints.update(source)
+        writes.append(_sources_cache_write())
+    return deltas, writes
+
+def _store_ratings(results, source):
+    """Обновляет рейтинги в памяти и пишет на диск изменившиеся; возвращает их изменения {предмет: RatingDelta}."""
+    deltas, writes = _apply_ratings(results, source)
+    _write_cache_files(writes)
+    return deltas
+
+def save_ratings_to_cache(results, source=None):
+    """
+    Сохраняет рейтинги нескольких предметов ({предмет: {имя: баллы}}) в кеш;
+    на диск пишутся только предметы, рейтинг которых изменился.
+    source: {имя файла: {'fingerprint': ..., 'subjects': [...]}} - отпечаток книги, из которой они получены
+    
+    Возвращает изменения рейтинга {предмет: RatingDelta} для изменившихся предметов
+    """
+    try:
+        deltas = _store_ratings(results, source)
+        logger.info(f"[RATING] Рейтинг сохранен в кеш, изменились: {list(deltas) or 'нет'}")
+        return deltas
     except Exception as e:
         logger.error(f"[RATING] Ошибка при сохранении кеша: {e}")
+        return {}
+
+async def _save_ratings_async(results, source):
+    """
+    То же, что save_ratings_to_cache, но файлы кеша пишутся в рабочем потоке.
+    Данные в памяти меняются здесь же, в event loop, - иначе поток менял бы их одновременно
+    с ленивым чтением предметов из геттеров.
+    """
+    try:
+        deltas, writes = _apply_ratings(results, source)
+    except Exception as e:
+        logger.error(f"[RATING] Ошибка при обновлении рейтинга: {e}")
+        return {}
+    try:
+        await asyncio.to_thread(_write_cache_files, writes)
+        logger.info(f"[RATING] Рейтинг сохранен в кеш, изменились: {list(deltas) or 'нет'}")
+    except Exception as e:
+        # Рейтинг в памяти уже обновлён - изменения всё равно передаются подписчикам
+        logger.error(f"[RATING] Ошибка при сохранении кеша: {e}")
+    return deltas
+
+def save_rating_to_cache(rating_data, subject):
+    """Сохраняет рейтинг в кеш."""
+    save_ratings_to_cache({subject: rating_data})
+
+def _migrate_legacy_cache():
+    """Переносит старый кеш RATING_FILE (все предметы одним pickle) в файлы по предметам."""
+    logger.info(f"[RATING] Перенос кеша рейтинга из {RATING_FILE} в {RATING_CACHE_DIR}")
+    with open(RATING_FILE, 'rb') as f:
+        cached = pickle.load(f)
+    if 'fingerprints' in cached:
+        legacy_ratings, fingerprints = cached['ratings'], cached['fingerprints']
+    else:
+        # Самый старый формат - только рейтинги; первое обновление скачает книгу заново
+        legacy_ratings, fingerprints = cached, {}
+    _store_ratings(legacy_ratings, fingerprints)
+    # Старый файл удаляется, только если все предметы записаны
+    os.remove(RATING_FILE)
 
 def load_rating_from_cache():
-    """Загружает рейтинг из кеша."""
-    global ratings
+    """
+    Загружает отпечатки книг из кеша; рейтинги предметов читаются при первом обращении.
+    Старый кеш одним файлом переносится в каталог RATING_CACHE_DIR.
+    """
+    global source_fingerprints
     try:
         if os.path.exists(RATING_FILE):
-            with open(RATING_FILE, 'rb') as f:
-                ratings = pickle.load(f)
-            logger.info(f"[RATING] Рейтинг загружен из кеша")
+            _migrate_legacy_cache()
+        with open(os.path.join(RATING_CACHE_DIR, _SOURCES_FILE), 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') == RATING_CACHE_VERSION:
+            source_fingerprints = cached['fingerprints']
         else:
-            logger.info(f"[RATING] Файл кеша не найден")
+            logger.warning(f"[RATING] Отпечатки книг в кеше другой версии ({cached.get('version')}), книга будет скачана заново")
+        logger.info(f"[RATING] Кеш рейтинга подключен: {RATING_CACHE_DIR}")
+    except FileNotFoundError:
+        logger.info(f"[RATING] Файл кеша не найден")
     except Exception as e:
         logger.error(f"[RATING] Ошибка при загрузке кеша: {e}")
 
-def update_rating(subject='ЯП'):
+async def update_ratings(subjects=None, progress=None):
     """
-    Обновляет рейтинг из Яндекс.Диска.
-    subject: предмет (по умолчанию 'ЯП')
+    Обновляет рейтинги нескольких предметов из Яндекс.Диска: книга скачивается
+    и разбирается один раз, листы берутся из RATING_SHEETS.
+    Скачивание асинхронное, разбор - в рабочем потоке; задачу можно отменить.
+    Если книга не изменилась с обновления, в котором уже разбирались эти предметы,
+    обходится одним запросом списка папки и возвращает рейтинги из кеша.
+    Изменения рейтинга попадают в last_rating_deltas и передаются rating_listeners.
+    subjects: предметы (по умолчанию все из RATING_SHEETS)
+    progress: async-функция progress(text) для показа хода обновления
     
-    Возвращает словарь с обновленным рейтингом или None если ошибка
+    Возвращает словарь {предмет: {имя: баллы}} с обновлёнными рейтингами или None если ошибка
     """
-    logger.info(f"[RATING] Начало обновления рейтинга для '{subject}'")
+    global last_rating_deltas
+    if subjects is None:
+        subjects = list(RATING_SHEETS)
+    sheets = {RATING_SHEETS.get(subject, f'25КБ-1 {subject}'): subject for subject in subjects}
+    logger.info(f"[RATING] Начало обновления рейтинга для {list(subjects)}")
+    
+    # Отпечаток проверяем, только если с ним уже разбирались все запрошенные предметы
+    source = source_fingerprints.get(TARGET_FILE_NAME)
+    known_fingerprint = None
+    if source and set(subjects) <= set(source['subjects']):
+        known_fingerprint = source['fingerprint']
     
     # Скачиваем файл
-    file_path = download_file_from_yandex(YANDEX_DISK_LINK)
-    if not file_path:
+    book, fingerprint = await download_file_from_yandex(YANDEX_DISK_LINK, progress, known_fingerprint)
+    if book is None:
+        if fingerprint is not None:
+            await _report(progress, "✅ Таблица не изменилась с прошлого обновления")
+            last_rating_deltas = {}
+            return {subject: get_cached_rating(subject) for subject in subjects if get_cached_rating(subject)}
         logger.error(f"[RATING] Не удалось скачать файл с Яндекс.Диска")
         return None
     
-    # Парсим файл
-    rating_data = parse_ods_file(file_path, f'25КБ-1 {subject}')
+    try:
+        await _report(progress, "⏳ Разбираю таблицу...")
+    except BaseException:
+        book.close()
+        raise
+    # Парсим все нужные листы за один проход
+    # Разбор идёт в рабочем потоке, event loop тем временем обслуживает пользователей.
+    # Книгой дальше владеет поток: он закроет её и при отмене обновления, дочитав до конца
+    sheet_results = await asyncio.to_thread(_parse_downloaded_book, book, list(sheets))
+    
+    # Пустой лист не затирает последний загруженный рейтинг предмета
+    results = {sheets[sheet]: data for sheet, data in sheet_results.items() if data}
+    for subject in subjects:
+        if subject in results:
+            logger.info(f"[RATING] Рейтинг успешно обновлен для '{subject}': {len(results[subject])} студентов")
+        else:
+            logger.error(f"[RATING] Не удалось загрузить рейтинг для '{subject}'")
+    if not results:
+        return None
+    
+    # Запоминаем отпечаток книги; при том же отпечатке ранее разобранные предметы остаются актуальными
+    covered = set(subjects)
+    if source and fingerprint is not None and source['fingerprint'] == fingerprint:
+        covered.update(source['subjects'])
+    new_source = None
+    if fingerprint is not None:
+        new_source = {TARGET_FILE_NAME: {'fingerprint': fingerprint, 'subjects': sorted(covered)}}
     
-    # Очищаем временный файл ВСЕГДА после обработки
+    # Сохраняем в кеш
+    await _report(progress, "⏳ Сохраняю рейтинг...")
+    deltas = await _save_ratings_async(results, new_source)
+    last_rating_deltas = deltas
+    if any(deltas.values()):
+        for listener in list(rating_listeners):
+            try:
+                listener(deltas)
+            except Exception as e:
+                logger.error(f"[RATING] Ошибка обработчика изменений рейтинга: {e}")
+    return results
+
+# --- Единственное обновление за раз (single-flight) ---
+# Ручные и плановые обновления идут через refresh_ratings: пока обновление выполняется,
+# новые вызовы ждут его результата, а не запускают ещё одно скачивание.
+_refresh_task = None
+# Функции прогресса всех, кто ждёт идущего обновления, и последний показанный текст
+_refresh_progress = []
+_refresh_status = None
+
+async def _report_refresh(text):
+    global _refresh_status
+    _refresh_status = text
+    for progress in list(_refresh_progress):
+        await _report(progress, text)
+
+def is_rating_refresh_running():
+    return _refresh_task is not None and not _refresh_task.done()
+
+async def refresh_ratings(progress=None):
+    """
+    Обновляет рейтинги всех предметов (update_ratings), не допуская параллельных обновлений:
+    если обновление уже идёт, присоединяется к нему и возвращает его результат.
+    progress подключается к идущему обновлению. Отмена вызывающего само обновление
+    не отменяет - для этого cancel_rating_refresh().
+    """
+    global _refresh_task, _refresh_status
+    if not is_rating_refresh_running():
+        _refresh_status = None
+        _refresh_task = asyncio.create_task(update_ratings(progress=_report_refresh))
+    elif progress is not None:
+        logger.info(f"[RATING] Обновление уже идёт - ждём его результата")
+        if _refresh_status:
+            await _report(progress, _refresh_status)
+    
+    task = _refresh_task
+    if progress is not None:
+        _refresh_progress.append(progress)
     try:
-        os.remove(file_path)
-        logger.info(f"[RATING] Временный файл удален после обработки")
-    except Exception as e:
-        logger.warning(f"[RATING] Не удалось удалить временный файл {file_path}: {e}")
+        return await asyncio.shield(task)
+    finally:
+        if progress is not None:
+            _refresh_progress.remove(progress)
+
+def cancel_rating_refresh():
+    """Отменяет идущее обновление рейтинга (у всех ожидающих). Возвращает False, если оно не идёт."""
+    if not is_rating_refresh_running():
+        return False
+    _refresh_task.cancel()
+    return True
+
+async def update_rating(subject='ЯП'):
+    """
+    Обновляет рейтинг из Яндекс.Диска.
+    subject: предмет (по умолчанию 'ЯП')
     
-    if rating_data:  # <-- ИСПРАВЛЕНО: rating_data, а не rating_
-        # Сохраняем в кеш
-        save_rating_to_cache(rating_data, subject)
-        logger.info(f"[RATING] Рейтинг успешно обновлен для '{subject}': {len(rating_data)} студентов")
-        return rating_data
+    Возвращает словарь с обновленным рейтингом или None если ошибка
+    """
+    results = await refresh_ratings()
+    return results.get(subject) if results else None
+
+# --- Плановое автообновление (JobQueue приложения) ---
+_refresh_job = None
+_refresh_failures = 0
+
+def _next_refresh_delay():
+    """Период автообновления со случайным разбросом; после неудач - удваивающаяся пауза."""
+    if _refresh_failures:
+        delay = min(RATING_REFRESH_RETRY * 2 ** (_refresh_failures - 1), RATING_REFRESH_INTERVAL)
     else:
-        logger.error(f"[RATING] Не удалось загрузить рейтинг для '{subject}'")
-        return None
+        delay = RATING_REFRESH_INTERVAL
+    return delay * random.uniform(1 - RATING_REFRESH_JITTER, 1 + RATING_REFRESH_JITTER)
+
+async def _scheduled_refresh(context):
+    global _refresh_job, _refresh_failures
+    logger.info(f"[RATING] Плановое обновление рейтинга")
+    try:
+        results = await refresh_ratings()
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            # Останавливается само приложение
+            raise
+        # Обновление отменил разработчик - это не ошибка, следующее по расписанию
+        logger.info(f"[RATING] Плановое обновление рейтинга отменено")
+        results = {}
+    except Exception as e:
+        logger.error(f"[RATING] Ошибка планового обновления рейтинга: {e}")
+        results = None
+    
+    _refresh_failures = 0 if results is not None else _refresh_failures + 1
+    delay = _next_refresh_delay()
+    if _refresh_failures:
+        logger.warning(f"[RATING] Плановое обновление не удалось ({_refresh_failures} раз подряд), повтор через {delay:.0f} с")
+    _refresh_job = context.job_queue.run_once(_scheduled_refresh, delay, name='rating_refresh')
+
+async def start_rating_refresh(app_instance):
+    """Включает плановое автообновление рейтинга (вызывается из post_init приложения)."""
+    global _refresh_job
+    if app_instance.job_queue is None:
+        logger.warning(f"[RATING] JobQueue недоступна (нужен python-telegram-bot[job-queue]) - автообновление рейтинга выключено")
+        return
+    delay = RATING_REFRESH_FIRST_DELAY * random.uniform(1, 1 + RATING_REFRESH_JITTER)
+    _refresh_job = app_instance.job_queue.run_once(_scheduled_refresh, delay, name='rating_refresh')
+    logger.info(f"[RATING] Автообновление рейтинга включено: каждые {RATING_REFRESH_INTERVAL} с ±{RATING_REFRESH_JITTER:.0%}")
+
+async def stop_rating_refresh(app_instance=None):
+    """Отключает автообновление, отменяет идущее обновление рейтинга и закрывает HTTP-клиент."""
+    global _refresh_job
+    if _refresh_job is not None:
+        try:
+            _refresh_job.schedule_removal()
+        except Exception:
+            # Задание уже выполняется или очередь заданий остановлена
+            pass
+        _refresh_job = None
+    if cancel_rating_refresh():
+        try:
+            await _refresh_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    await close_http_client()
 
 def get_cached_rating(subject='ЯП'):
     """Возвращает текущий рейтинг из кеша."""
+    _load_subject(subject)
     return ratings.get(subject, {})
 
+def get_rank_table(subject='ЯП'):
+    """Возвращает таблицу мест предмета или None, если рейтинг не загружен."""
+    _load_subject(subject)
+    return rank_tables.get(subject)
+
+def get_rendered_rating(subject='ЯП'):
+    """Возвращает готовые сообщения рейтинга (RenderedRating) или None, если рейтинг не загружен."""
+    _load_subject(subject)
+    return rendered_ratings.get(subject)
+
+def get_last_rating_deltas():
+    """Возвращает изменения рейтинга последнего обновления: {предмет: RatingDelta}."""
+    return last_rating_deltas
+
 def get_user_rating(user_name, subject='ЯП'):
     """Получает оценку конкретного пользователя."""
+    _load_subject(subject)
     if subject not in ratings:
         logger.warning(f"[RATING] Рейтинг для '{subject}' не загружен. Используйте update_rating()")
         return None
@@ -241,43 +1058,67 @@ def get_user_rating(user_name, subject='ЯП'):
 
 def get_top_rating(subject='ЯП', limit=10):
     """Возвращает топ студентов по оценкам."""
+    _load_subject(subject)
     if subject not in ratings:
         logger.warning(f"[RATING] Рейтинг для '{subject}' не загружен")
         return []
     
-    # Сортируем по баллам в убывающем порядке
-    sorted_rating = sorted(ratings[subject].items(), key=lambda x: x[1], reverse=True)
-    return sorted_rating[:limit]
+    return [(name, score) for _, name, score in rank_tables[subject].top(limit)]
 
 def get_user_rank(user_name, subject='ЯП'):
     """Получает место студента в рейтинге."""
+    _load_subject(subject)
     if subject not in ratings:
         logger.warning(f"[RATING] Рейтинг для '{subject}' не загружен")
         return None
     
-    sorted_rating = sorted(ratings[subject].items(), key=lambda x: x[1], reverse=True)
-    
-    for rank, (name, score) in enumerate(sorted_rating, start=1):
-        if name == user_name:
-            return rank
-    
-    return None
+    return rank_tables[subject].rank(user_name)
 
 def format_rating_message(subject='ЯП'):
     """Форматирует рейтинг в красивое сообщение."""
-    top = get_top_rating(subject, limit=10)
+    rendered = get_rendered_rating(subject)
     
-    if not top:
+    if not rendered:
         return f"📊 Рейтинг по '{subject}' не загружен"
     
-    message = f"📊 <b>Топ рейтинга по {subject}:</b>\n\n"
-    
-    for rank, (name, score) in enumerate(top, start=1):
-        medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"{rank}."
-        message += f"{medal} <b>{name}</b> — {score:.2f} лаб\n"
-    
-    return message
+    return rendered.top
+
+def _format_change(change):
+    name, old_rank, old_score, new_rank, new_score = change
+    if old_rank is None:
+        return f"+ {name}: {new_score:.2f}, место {new_rank}"
+    if new_rank is None:
+        return f"− {name} (было {old_score:.2f}, место {old_rank})"
+    if old_score != new_score:
+        return f"• {name}: {old_score:.2f} → {new_score:.2f}, место {old_rank} → {new_rank}"
+    return f"• {name}: место {old_rank} → {new_rank}"
+
+def format_rating_delta(results, deltas, limit=5):
+    """
+    Сводка обновления для разработчика: по каждому предмету число появившихся, выбывших,
+    изменивших баллы и сдвинувшихся студентов и не больше limit примеров каждого вида.
+    """
+    sections = []
+    for subject, rating_data in results.items():
+        delta = deltas.get(subject)
+        header = f"📊 <b>{subject}</b> ({len(rating_data)} студентов)"
+        if delta is None or not delta:
+            sections.append(f"{header}: без изменений")
+            continue
+        if delta.initial:
+            sections.append(f"{header}: загружен впервые")
+            continue
+        lines = [
+            f"{header}: новых {len(delta.added)}, выбыло {len(delta.removed)}, "
+            f"изменили баллы {len(delta.score_changed)}, сдвинулись {len(delta.rank_moved)}"
+        ]
+        for changes in (delta.added, delta.removed, delta.score_changed, delta.rank_moved):
+            lines.extend(_format_change(change) for change in changes[:limit])
+            if len(changes) > limit:
+                lines.append(f"  … и ещё {len(changes) - limit}")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
 
-# Загружаем рейтинг при импорте модуля
+# Подключаем кеш рейтинга при импорте модуля (сами рейтинги читаются по требованию)
 load_rating_from_cache()
 
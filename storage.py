@@ -0,0 +1,301 @@
+# storage.py
+
+import os
+import pickle
+import sqlite3
+import logging
+from constants import (
+    STORAGE_BACKEND, DATA_FILE, JOURNAL_FILE, JOURNAL_COMPACT_THRESHOLD, SQLITE_FILE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Очереди в снимках - списки ID пользователей в порядке очереди.
+# Хранилище получает изменения в виде записей (op, args) - тех же, что применяет data.py:
+#   ("register", (user_id, name)), ("forget", (user_id,)),
+#   ("join", (user_id, subject, position)), ("leave", (user_id, subject)),
+#   ("move", (user_id, subject, position)), ("ban", (user_id,)), ("unban", (user_id,)),
+#   ("notify", (user_id, enabled))
+#
+# Каждое хранилище реализует:
+#   load() -> (user_names, queues, records) - снимок и записи, которые нужно проиграть поверх него
+#   append(records) - сохраняет новые записи
+#   save_snapshot(user_names, queues) - полностью перезаписывает данные
+#   needs_snapshot() - нужно ли сохранить полный снимок (компактификация, миграция)
+
+
+def _fsync_directory(path):
+    """Сбрасывает на диск запись каталога после os.replace (там, где это поддерживается)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class PickleJournalStorage:
+    """Снимок в pickle-файле + журнал операций, дописываемый в конец."""
+
+    def __init__(self, data_file=DATA_FILE, journal_file=JOURNAL_FILE, compact_threshold=JOURNAL_COMPACT_THRESHOLD):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self.compact_threshold = compact_threshold
+        self.journal_size = 0
+        self.snapshot_missing = False
+
+    def load(self):
+        """Загружает снимок и все записи журнала."""
+        users, queues = {}, {}
+        try:
+            with open(self.data_file, 'rb') as f:
+                loaded_data = pickle.load(f)
+            users = loaded_data.get('user_names', {})
+            queues = loaded_data.get('queues', {})
+            logger.info(f"Данные успешно загружены из {self.data_file}")
+        except FileNotFoundError:
+            logger.info(f"Файл {self.data_file} не найден. Используем начальные значения.")
+            self.snapshot_missing = True
+
+        records = self.read_journal()
+        self.journal_size = len(records)
+        return users, queues, records
+
+    def read_journal(self):
+        """
+        Читает записи журнала до конца файла или до повреждённого хвоста.
+        Повреждённый хвост обрезается: иначе append дописывал бы новые записи за ним,
+        и следующая загрузка остановилась бы на том же месте, потеряв их.
+        """
+        records = []
+        torn_offset = None
+        try:
+            with open(self.journal_file, 'rb') as f:
+                good_offset = 0
+                while True:
+                    try:
+                        records.append(pickle.load(f))
+                    except EOFError:
+                        # Запись, оборванная на границе кадра pickle, тоже даёт EOFError
+                        if good_offset < os.fstat(f.fileno()).st_size:
+                            logger.warning(f"Недописанная запись в конце журнала {self.journal_file} после {len(records)} записей")
+                            torn_offset = good_offset
+                        break
+                    except Exception as e:
+                        # Недописанная последняя запись (например, при падении процесса)
+                        logger.warning(f"Повреждённый хвост журнала {self.journal_file} после {len(records)} записей: {e}")
+                        torn_offset = good_offset
+                        break
+                    good_offset = f.tell()
+        except FileNotFoundError:
+            pass
+        if torn_offset is not None:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(torn_offset)
+                f.flush()
+                os.fsync(f.fileno())
+            logger.warning(f"Журнал {self.journal_file} обрезан до {torn_offset} байт")
+        return records
+
+    def append(self, records):
+        with open(self.journal_file, 'ab') as f:
+            for record in records:
+                pickle.dump(record, f)
+            # Один fsync на всю пачку записей
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_size += len(records)
+
+    def save_snapshot(self, user_names, queues):
+        data_to_save = {
+            'user_names': user_names,
+            'queues': queues,
+        }
+        # Пишем во временный файл и атомарно подменяем им снимок,
+        # чтобы падение посреди записи не оставило обрезанный DATA_FILE
+        temp_file = self.data_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            pickle.dump(data_to_save, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.data_file)
+        _fsync_directory(self.data_file)
+        # Снимок уже содержит все операции журнала - журнал можно обнулить
+        open(self.journal_file, 'wb').close()
+        self.journal_size = 0
+        self.snapshot_missing = False
+
+    def needs_snapshot(self):
+        return self.snapshot_missing or self.journal_size >= self.compact_threshold
+
+
+class SQLiteStorage:
+    """
+    SQLite (WAL) с таблицами users и queue_entries.
+    Каждое изменение - одна-две индексированные строки, а не перезапись всех данных.
+    Позиция в очереди хранится как REAL: вставка между соседями берёт среднее их позиций,
+    поэтому остальные записи очереди не сдвигаются.
+    """
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=SQLITE_FILE, legacy_storage=None):
+        self.path = path
+        self.legacy_storage = legacy_storage
+        self.migration_pending = False
+        # Соединение используется и из фонового потока записи
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                banned INTEGER NOT NULL DEFAULT 0,
+                notify INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS users_banned ON users(banned) WHERE banned = 1;
+            CREATE TABLE IF NOT EXISTS queue_entries (
+                subject TEXT NOT NULL,
+                position REAL NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (subject, position)
+            );
+            CREATE INDEX IF NOT EXISTS queue_entries_user ON queue_entries(user_id, subject);
+        """)
+        # Версия 1 схемы не хранила флаг уведомлений
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(users)")}
+        if "notify" not in columns:
+            self.conn.execute("ALTER TABLE users ADD COLUMN notify INTEGER NOT NULL DEFAULT 0")
+
+    def load(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0 and self.legacy_storage is not None and os.path.exists(self.legacy_storage.data_file):
+            # Одноразовая миграция: data.py проиграет старые данные и сохранит их снимком
+            logger.info(f"Миграция данных из {self.legacy_storage.data_file} в {self.path}")
+            self.migration_pending = True
+            return self.legacy_storage.load()
+        if version != self.SCHEMA_VERSION:
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        users = {
+            uid: {"name": name, "banned": bool(banned), "notify": bool(notify)}
+            for uid, name, banned, notify in self.conn.execute("SELECT id, name, banned, notify FROM users")
+        }
+        queues = {}
+        rows = self.conn.execute("SELECT subject, user_id FROM queue_entries ORDER BY subject, position")
+        for subject, user_id in rows:
+            queues.setdefault(subject, []).append(user_id)
+        logger.info(f"Данные успешно загружены из {self.path}")
+        return users, queues, []
+
+    def append(self, records):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for op, args in records:
+                getattr(self, f"_op_{op}")(*args)
+
+    def _op_register(self, user_id, name):
+        self.conn.execute(
+            "INSERT INTO users (id, name) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+            (user_id, name),
+        )
+
+    def _op_forget(self, user_id):
+        self.conn.execute("DELETE FROM queue_entries WHERE user_id = ?", (user_id,))
+        self.conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    def _op_join(self, user_id, subject, position):
+        self._op_leave(user_id, subject)
+        key = self._position_key(subject, position)
+        self.conn.execute(
+            "INSERT INTO queue_entries (subject, position, user_id) VALUES (?, ?, ?)",
+            (subject, key, user_id),
+        )
+
+    def _op_leave(self, user_id, subject):
+        self.conn.execute("DELETE FROM queue_entries WHERE user_id = ? AND subject = ?", (user_id, subject))
+
+    # Перемещение - то же самое, что повторная запись на позицию
+    _op_move = _op_join
+
+    def _op_ban(self, user_id):
+        self.conn.execute("UPDATE users SET banned = 1 WHERE id = ?", (user_id,))
+        self.conn.execute("DELETE FROM queue_entries WHERE user_id = ?", (user_id,))
+
+    def _op_unban(self, user_id):
+        self.conn.execute("UPDATE users SET banned = 0 WHERE id = ?", (user_id,))
+
+    def _op_notify(self, user_id, enabled):
+        self.conn.execute("UPDATE users SET notify = ? WHERE id = ?", (int(enabled), user_id))
+
+    def _position_key(self, subject, index):
+        """Подбирает значение position так, чтобы запись встала на индекс index (None - в конец)."""
+        if index is not None and index >= 0:
+            if index == 0:
+                first = self.conn.execute(
+                    "SELECT MIN(position) FROM queue_entries WHERE subject = ?", (subject,)
+                ).fetchone()[0]
+                return 0.0 if first is None else first - 1
+            neighbours = [row[0] for row in self.conn.execute(
+                "SELECT position FROM queue_entries WHERE subject = ? ORDER BY position LIMIT 2 OFFSET ?",
+                (subject, index - 1),
+            )]
+            if len(neighbours) == 2:
+                before, after = neighbours
+                key = (before + after) / 2
+                if before < key < after:
+                    return key
+                # Точность REAL исчерпана - перенумеровываем очередь и пробуем снова
+                self._renumber(subject)
+                return self._position_key(subject, index)
+        last = self.conn.execute(
+            "SELECT MAX(position) FROM queue_entries WHERE subject = ?", (subject,)
+        ).fetchone()[0]
+        return 0.0 if last is None else last + 1
+
+    def _renumber(self, subject):
+        user_ids = [row[0] for row in self.conn.execute(
+            "SELECT user_id FROM queue_entries WHERE subject = ? ORDER BY position", (subject,)
+        )]
+        self.conn.execute("DELETE FROM queue_entries WHERE subject = ?", (subject,))
+        self.conn.executemany(
+            "INSERT INTO queue_entries (subject, position, user_id) VALUES (?, ?, ?)",
+            [(subject, float(pos), uid) for pos, uid in enumerate(user_ids)],
+        )
+
+    def save_snapshot(self, user_names, queues):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM queue_entries")
+            self.conn.execute("DELETE FROM users")
+            self.conn.executemany(
+                "INSERT INTO users (id, name, banned, notify) VALUES (?, ?, ?, ?)",
+                [
+                    (uid, data["name"], int(data.get("banned", False)), int(data.get("notify", False)))
+                    for uid, data in user_names.items()
+                ],
+            )
+            for subject, queue in queues.items():
+                self.conn.executemany(
+                    "INSERT INTO queue_entries (subject, position, user_id) VALUES (?, ?, ?)",
+                    [(subject, float(pos), uid) for pos, uid in enumerate(queue)],
+                )
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.migration_pending = False
+
+    def needs_snapshot(self):
+        return self.migration_pending
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    """Создаёт хранилище, выбранное в constants.STORAGE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteStorage(legacy_storage=PickleJournalStorage())
+    if backend != "pickle":
+        logger.warning(f"Неизвестное хранилище '{backend}', используется 'pickle'.")
+    return PickleJournalStorage()
@@ -0,0 +1,196 @@
+# stress_queue.py
+
+"""
+Стресс-тест очередей: пользователи одновременно записываются в очереди и выходят из них,
+а разработчики переставляют чужих пользователей (ставят за выбранным соседом, как вставка
+на позицию в меню разработчика). Все апдейты идут через PerUserUpdateProcessor, обработчики
+ждут со случайной задержкой до и внутри queue_lock - между чтением очереди и её изменением.
+Проверяется, что позиции в очередях уникальны и идут подряд, итоговый порядок совпадает
+с последовательным проигрыванием тех же действий, апдейты каждого пользователя обработаны
+в порядке поступления и одновременно выполняется не больше лимита обработчиков.
+Без queue_lock перестановки разработчиков читают устаревшие позиции и проверка падает.
+Данные пишутся во временный каталог, bot_data.db не меняется.
+Запуск: python stress_queue.py [--users 300] [--updates 6] [--devs 4] [--dev-updates 40]
+                               [--latency 0.01] [--limit 64] [--seed 1]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from constants import MAX_CONCURRENT_UPDATES, SUBJECTS
+
+# ID разработчиков не пересекаются с ID пользователей
+DEV_ID_BASE = 10 ** 9
+
+
+def _plan(args, rng):
+    """Апдейты каждого пользователя и разработчика и общий порядок их поступления."""
+    actions = {
+        user_id: [("join" if rng.random() < 0.7 else "leave", rng.choice(SUBJECTS)) for _ in range(args.updates)]
+        for user_id in range(1, args.users + 1)
+    }
+    for dev in range(args.devs):
+        actions[DEV_ID_BASE + dev] = [("place", rng.choice(SUBJECTS)) for _ in range(args.dev_updates)]
+    # Апдейты разных пользователей перемешаны, апдейты одного пользователя идут в своём порядке
+    arrivals = [user_id for user_id, user_actions in actions.items() for _ in user_actions]
+    rng.shuffle(arrivals)
+    return actions, arrivals
+
+
+def _replay(log):
+    """
+    Последовательно проигрывает действия в порядке их применения, каждое - по состоянию
+    очереди на момент применения: так очереди выглядели бы без одновременной обработки.
+    """
+    model = {subject: [] for subject in SUBJECTS}
+    for op, subject, user_id, neighbour in log:
+        queue = model[subject]
+        if op == "join":
+            if user_id not in queue:
+                queue.append(user_id)
+        elif op == "leave":
+            if user_id in queue:
+                queue.remove(user_id)
+        else:
+            # Поставить user_id сразу за neighbour
+            if user_id in queue:
+                queue.remove(user_id)
+            assert neighbour in queue, f"{subject}: {neighbour} вышел из очереди до перестановки {user_id}"
+            queue.insert(queue.index(neighbour) + 1, user_id)
+    return model
+
+
+def _check_queues(queues, expected):
+    for subject, queue in queues.items():
+        ids = list(queue)
+        assert len(ids) == len(queue), f"{subject}: длина очереди не совпадает с числом записей"
+        assert len(set(ids)) == len(ids), f"{subject}: пользователь записан дважды"
+        assert ids == expected[subject], f"{subject}: порядок очереди не совпадает с последовательным проигрыванием"
+        for position, user_id in enumerate(ids):
+            assert queue.index(user_id) == position, f"{subject}: позиция {user_id} не {position}"
+        assert queue.slice(0, len(ids)) == ids, f"{subject}: slice не совпадает с очередью"
+
+
+async def run(args):
+    # data.py загружает данные при импорте из текущего каталога
+    import data
+    from update_processor import PerUserUpdateProcessor
+
+    rng = random.Random(args.seed)
+    actions, arrivals = _plan(args, rng)
+    for user_id in range(1, args.users + 1):
+        data.register_user(user_id, f"Студент {user_id}")
+
+    processor = PerUserUpdateProcessor(args.limit)
+    await processor.initialize()
+    await data.start_persistence()
+
+    # Действия (операция, предмет, пользователь, сосед) в порядке применения к очередям
+    log = []
+    handled = {user_id: [] for user_id in actions}
+    running = {"all": 0, "peak": 0, "users": set()}
+
+    async def join_or_leave(user_id, op, subject):
+        async with data.queue_lock(subject):
+            queue = data.queues[subject]
+            in_queue = user_id in queue
+            # Ожидание между проверкой и изменением очереди - как запрос к Telegram в обработчике
+            await asyncio.sleep(rng.uniform(0, args.latency))
+            if op == "join" and not in_queue:
+                data.add_user_to_queue(user_id, subject)
+            elif op == "leave" and in_queue:
+                data.remove_user_from_queue(user_id, subject)
+            log.append((op, subject, user_id, None))
+
+    async def place(subject):
+        async with data.queue_lock(subject):
+            queue = data.queues[subject]
+            if not queue:
+                return
+            # Разработчик ставит случайного пользователя за случайным стоящим в очереди
+            index = rng.randrange(len(queue))
+            neighbour = queue.slice(index, index + 1)[0]
+            user_id = rng.randint(1, args.users)
+            if user_id == neighbour:
+                return
+            # Позиция вычисляется по текущей очереди, а применяется после ожидания подтверждения
+            position = queue.index(neighbour) + 1
+            if user_id in queue and queue.index(user_id) < position:
+                position -= 1
+            await asyncio.sleep(rng.uniform(0, args.latency))
+            data.add_user_to_queue(user_id, subject, position)
+            log.append(("place", subject, user_id, neighbour))
+
+    async def handle(user_id, seq, op, subject):
+        assert user_id not in running["users"], f"апдейты пользователя {user_id} обрабатываются одновременно"
+        running["users"].add(user_id)
+        running["all"] += 1
+        running["peak"] = max(running["peak"], running["all"])
+        handled[user_id].append(seq)
+        try:
+            await asyncio.sleep(rng.uniform(0, args.latency))
+            if op == "place":
+                await place(subject)
+            else:
+                await join_or_leave(user_id, op, subject)
+            await asyncio.sleep(rng.uniform(0, args.latency))
+        finally:
+            running["all"] -= 1
+            running["users"].discard(user_id)
+
+    started = time.perf_counter()
+    next_seq = dict.fromkeys(actions, 0)
+    tasks = []
+    for user_id in arrivals:
+        seq = next_seq[user_id]
+        next_seq[user_id] += 1
+        op, subject = actions[user_id][seq]
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(user_id, seq, op, subject))))
+        if rng.random() < 0.1:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await data.stop_persistence()
+
+    for user_id, seqs in handled.items():
+        assert seqs == list(range(len(actions[user_id]))), f"апдейты пользователя {user_id} обработаны не по порядку: {seqs}"
+    assert running["peak"] <= args.limit, f"одновременно выполнялось {running['peak']} обработчиков при лимите {args.limit}"
+    _check_queues(data.queues, _replay(log))
+    assert not processor._user_locks, "локи пользователей не освобождены"
+
+    placed = sum(1 for op, *_ in log if op == "place")
+    sizes = ", ".join(f"{subject}: {len(queue)}" for subject, queue in data.queues.items())
+    print(f"{len(tasks)} апдейтов от {args.users} пользователей и {args.devs} разработчиков за {elapsed:.2f} с "
+          f"({placed} перестановок), одновременно до {running['peak']} обработчиков; очереди - {sizes}")
+    print("Позиции уникальны и идут подряд, порядок совпадает с последовательным проигрыванием, "
+          "порядок апдейтов каждого пользователя сохранён")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=300, help='число пользователей')
+    parser.add_argument('--updates', type=int, default=6, help='апдейтов от каждого пользователя')
+    parser.add_argument('--devs', type=int, default=4, help='число разработчиков, переставляющих пользователей')
+    parser.add_argument('--dev-updates', type=int, default=40, help='перестановок от каждого разработчика')
+    parser.add_argument('--latency', type=float, default=0.01, help='максимальная случайная задержка в обработчике, с')
+    parser.add_argument('--limit', type=int, default=MAX_CONCURRENT_UPDATES, help='лимит одновременных обработчиков')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора случайных чисел')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# update_processor.py
+
+import asyncio
+import logging
+from telegram.ext import BaseUpdateProcessor
+from constants import MAX_CONCURRENT_UPDATES
+
+logger = logging.getLogger(__name__)
+
+# Лимит общего семафора PTB: фактически без ограничения, см. PerUserUpdateProcessor
+_UNLIMITED = 2 ** 31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает апдейты параллельно (до max_concurrent_updates одновременно),
+    но апдейты одного пользователя - строго по очереди, в порядке поступления.
+    Медленный обработчик одного пользователя (например, обновление рейтинга)
+    больше не задерживает нажатия кнопок остальных.
+
+    PTB занимает свой семафор ещё до do_process_update, и апдейты, ждущие лок своего
+    пользователя, держали бы общие слоты - серия нажатий одного пользователя останавливала бы
+    весь бот. Поэтому семафор PTB не ограничивает, а лимит max_concurrent_updates
+    берётся только после лока пользователя.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(_UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._processing = asyncio.Semaphore(max_concurrent_updates)
+        # ID пользователя -> [asyncio.Lock, число апдейтов, ожидающих или держащих лок]
+        self._user_locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            async with self._processing:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock отдаётся ожидающим в порядке FIFO - порядок апдейтов сохраняется
+            async with entry[0], self._processing:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user.id]
+
+    async def initialize(self):
+        logger.info(f"Параллельная обработка апдейтов: до {self.limit} одновременно")
+
+    async def shutdown(self):
+        pass
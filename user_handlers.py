@@ -1,37 +1,17 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
-from constants import SUBJECTS
-from data import user_names, queues, is_user_banned
-from rating import get_cached_rating  # Импортируем функцию для получения кеша
+from data import user_names, queues, queue_lock, add_user_to_queue, remove_user_from_queue, set_user_notify, is_user_notified
+from notifications import remember_position
+from editing import edit_message
+from views import SUBJECTS_MENU_MARKUP, BACK_TO_MENU_MARKUP, build_queue_view, get_rating_markup
+from rating import get_rendered_rating  # Страницы рейтинга, отрисованные при обновлении
 
 logger = logging.getLogger(__name__)
 
-def get_user_queue_keyboard(subject, is_in_queue):
-    """Создает клавиатуру для меню очереди в зависимости от того, находится ли пользователь в очереди."""
-    if is_in_queue:
-        keyboard = [
-            [InlineKeyboardButton("Сдал", callback_data=f'passed_{subject}'),
-             InlineKeyboardButton("← Назад", callback_data='back_to_menu')]
-        ]
-        logger.debug(f"Создана клавиатура для пользователя В очереди по '{subject}'.")
-    else:
-        keyboard = [
-            [InlineKeyboardButton("Записаться", callback_data=f'join_{subject}'),
-             InlineKeyboardButton("← Назад", callback_data='back_to_menu')]
-        ]
-        logger.debug(f"Создана клавиатура для пользователя НЕ в очереди по '{subject}'.")
-    return keyboard
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     
-    # Проверка бана ПЕРВЫМ ДЕЛОМ
-    if is_user_banned(user_id):
-        await update.message.reply_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался использовать /start")
-        return
-    
     user_data = user_names.get(user_id)
     user_name = user_data["name"] if user_data else "Неизвестный пользователь"
     logger.info(f"Пользователь {user_id} ({user_name}) вызвал команду /start.")
@@ -49,14 +29,10 @@ async def show_subjects(update: Update) -> None:
     user_name = user_data["name"] if user_data else "Miha"
     
     logger.info(f"Формирование меню выбора предметов для пользователя {user_id} ({user_name}).")
-    keyboard = [
-        [InlineKeyboardButton(subject, callback_data=f'show_queue_{subject}')] for subject in SUBJECTS
-    ]
-    # Добавляем кнопку "Рейтинг"
-    keyboard.append([InlineKeyboardButton("📊 Рейтинг", callback_data='show_rating')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Клавиатура с предметами и кнопкой "Рейтинг" создаётся один раз (см. views.py)
+    reply_markup = SUBJECTS_MENU_MARKUP
     if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.edit_message_text("Выбери предмет:", reply_markup=reply_markup)
+        await edit_message(update.callback_query, "Выбери предмет:", reply_markup=reply_markup)
         logger.info(f"Меню выбора предметов отправлено пользователю {user_id} ({user_name}) через callback_query.")
     else:
         await update.message.reply_text("Выбери предмет:", reply_markup=reply_markup)
@@ -68,12 +44,6 @@ async def show_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     user_id = query.from_user.id
     
-    # Проверка бана
-    if is_user_banned(user_id):
-        await query.edit_message_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался нажать show_queue")
-        return
-    
     if not query.data.startswith('show_queue_'):
         logger.warning(f"Получен неожиданный callback_ '{query.data}' от пользователя {query.from_user.id}.")
         return
@@ -83,20 +53,17 @@ async def show_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     subject = query.data.split('show_queue_')[1]
     logger.info(f"Пользователь {user_id} ({user_name}) запросил очередь по предмету '{subject}'.")
 
-    queue_list = "\n".join([f"{i+1}. {name}" for i, name in enumerate(queues[subject])])
-    if not queue_list:
-        queue_list = "Очередь пуста"
-    is_in_queue = user_name and user_name in queues[subject]
+    is_in_queue = user_id in queues[subject]
 
     if is_in_queue:
         logger.info(f"Пользователь {user_id} ({user_name}) находится в очереди по '{subject}'. Предложено действие 'Сдал'.")
     else:
         logger.info(f"Пользователь {user_id} ({user_name}) НЕ находится в очереди по '{subject}'. Предложено действие 'Записаться'.")
 
-    keyboard = get_user_queue_keyboard(subject, is_in_queue)
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        text=f"Очередь по '{subject}':\n{queue_list}",
+    text, reply_markup = build_queue_view(subject, user_id)
+    await edit_message(
+        query,
+        text=text,
         reply_markup=reply_markup
     )
     logger.info(f"Отправлена очередь по '{subject}' пользователю {user_id} ({user_name}).")
@@ -107,12 +74,6 @@ async def join_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     user_id = query.from_user.id
     
-    # Проверка бана
-    if is_user_banned(user_id):
-        await query.edit_message_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался нажать join_queue")
-        return
-    
     user_data = user_names.get(user_id)
     user_name = user_data["name"] if user_data else "Неизвестный пользователь"
     subject = query.data.split('join_')[1]
@@ -120,73 +81,93 @@ async def join_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
     if not user_name:
         logger.error(f"Пользователь {user_id} не найден в user_names при попытке записи в очередь '{subject}'.")
-        await query.edit_message_text(text="Произошла ошибка. Пожалуйста, начните с /start.")
+        await edit_message(query, text="Произошла ошибка. Пожалуйста, начните с /start.")
         return
 
-    if user_name in queues[subject]:
-        logger.info(f"Пользователь {user_id} ({user_name}) уже находится в очереди '{subject}'. Показана обновлённая очередь.")
-        await show_queue_direct(update, context, subject)
-        return
+    async with queue_lock(subject):
+        already_in_queue = user_id in queues[subject]
+        if not already_in_queue:
+            add_user_to_queue(user_id, subject)
 
-    queues[subject].append(user_name)
-    from data import save_data_to_file
-    save_data_to_file()
-    logger.info(f"Пользователь {user_id} ({user_name}) добавлен в очередь '{subject}'. Данные сохранены.")
+    if already_in_queue:
+        logger.info(f"Пользователь {user_id} ({user_name}) уже находится в очереди '{subject}'. Показана обновлённая очередь.")
+    else:
+        logger.info(f"Пользователь {user_id} ({user_name}) добавлен в очередь '{subject}'. Данные сохранены.")
     await show_queue_direct(update, context, subject)
 
 async def show_queue_direct(update: Update, context: ContextTypes.DEFAULT_TYPE, subject: str) -> None:
     query = update.callback_query
     user_id = query.from_user.id
     
-    # Проверка бана
-    if is_user_banned(user_id):
-        await query.edit_message_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался нажать show_queue_direct")
-        return
-    
     user_data = user_names.get(user_id)
     user_name = user_data["name"] if user_data else "Неизвестный пользователь"
     logger.info(f"Повторный показ очереди '{subject}' пользователю {user_id} ({user_name}).")
 
-    queue_list = "\n".join([f"{i+1}. {name}" for i, name in enumerate(queues[subject])])
-    if not queue_list:
-        queue_list = "Очередь пуста"
-
-    is_in_queue = user_name and user_name in queues[subject]
+    is_in_queue = user_id in queues[subject]
     if is_in_queue:
         logger.info(f"Пользователь {user_id} ({user_name}) в очереди '{subject}'. Предложено действие 'Сдал'.")
     else:
         logger.info(f"Пользователь {user_id} ({user_name}) не в очереди '{subject}'. Предложено действие 'Записаться'.")
 
-    keyboard = get_user_queue_keyboard(subject, is_in_queue)
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        text=f"Очередь по '{subject}':\n{queue_list}",
+    text, reply_markup = build_queue_view(subject, user_id)
+    await edit_message(
+        query,
+        text=text,
         reply_markup=reply_markup
     )
     logger.info(f"Отправлена обновлённая очередь по '{subject}' пользователю {user_id} ({user_name}).")
 
+async def show_queue_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    # queue_page_{предмет}_{номер страницы | me}
+    subject, page = query.data[len('queue_page_'):].rsplit('_', 1)
+    if subject not in queues:
+        logger.warning(f"Получен неожиданный callback_ '{query.data}' от пользователя {user_id}.")
+        return
+    page = None if page == 'me' else int(page)
+    logger.info(f"Пользователь {user_id} листает очередь '{subject}', страница {page}.")
+
+    text, reply_markup = build_queue_view(subject, user_id, page)
+    await edit_message(
+        query,
+        text=text,
+        reply_markup=reply_markup
+    )
+
+async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    subject = query.data.split('notify_toggle_')[1]
+    if subject not in queues:
+        logger.warning(f"Получен неожиданный callback_ '{query.data}' от пользователя {user_id}.")
+        return
+
+    enabled = not is_user_notified(user_id)
+    set_user_notify(user_id, enabled)
+    if enabled:
+        remember_position(user_id, subject)
+    logger.info(f"Пользователь {user_id} {'включил' if enabled else 'выключил'} уведомления об очереди.")
+    await show_queue_direct(update, context, subject)
+
 async def handle_passed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
     
-    # Проверка бана
-    if is_user_banned(user_id):
-        await query.edit_message_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался нажать handle_passed")
-        return
-    
     user_data = user_names.get(user_id)
     user_name = user_data["name"] if user_data else "Неизвестный пользователь"
     subject = query.data.split('passed_')[1]
     logger.info(f"Пользователь {user_id} ({user_name}) нажал 'Сдал' по предмету '{subject}'.")
 
-    if user_name and user_name in queues[subject]:
-        queues[subject].remove(user_name)
-        from data import save_data_to_file
-        save_data_to_file()
+    async with queue_lock(subject):
+        removed = remove_user_from_queue(user_id, subject)
+    if removed:
         logger.info(f"Пользователь {user_id} ({user_name}) удален из очереди '{subject}' после сдачи. Данные сохранены.")
     else:
         logger.info(f"Пользователь {user_id} ({user_name}) не найден в очереди '{subject}' при попытке сдать.")
@@ -200,12 +181,6 @@ async def go_back(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     user_id = query.from_user.id
     
-    # Проверка бана
-    if is_user_banned(user_id):
-        await query.edit_message_text("❌ Вы забанены и не можете использовать бот.")
-        logger.warning(f"Забаненный пользователь {user_id} попытался нажать go_back")
-        return
-    
     user_data = user_names.get(user_id)
     user_name = user_data["name"] if user_data else "Неизвестный пользователь"
     logger.info(f"Пользователь {user_id} ({user_name}) нажал '← Назад'.")
@@ -213,12 +188,16 @@ async def go_back(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info(f"Пользователю {user_id} ({user_name}) показано главное меню после нажатия 'Назад'.")
 
 async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показывает текущий рейтинг."""
+    """Показывает страницу текущего рейтинга."""
     query = update.callback_query
+    page = 0
     if query:
         await query.answer()
         user_id = query.from_user.id
         message = query.message
+        # show_rating или show_rating_{номер страницы}
+        if query.data.startswith('show_rating_'):
+            page = int(query.data.split('show_rating_')[1])
     else:
         user_id = update.effective_user.id
         message = update.message
@@ -227,36 +206,22 @@ async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     user_name = user_data["name"] if user_data else "Miha"
     logger.info(f"Пользователь {user_id} ({user_name}) запрашивает рейтинг")
     
-    # Получаем текущий рейтинг из кеша
-    rating_data = get_cached_rating('ЯП')
-    if not rating_data:
+    # Получаем готовые страницы рейтинга из кеша
+    rendered = get_rendered_rating('ЯП')
+    if not rendered:
         text = "📊 Рейтинг не загружен"
-        keyboard = [[InlineKeyboardButton("← Назад", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = BACK_TO_MENU_MARKUP
         if query:
-            await query.edit_message_text(text, reply_markup=reply_markup)
+            await edit_message(query, text, reply_markup=reply_markup)
         else:
             await message.reply_text(text, reply_markup=reply_markup)
         return
     
-    # Извлекаем фамилии и сортируем
-    surname_scores = {}
-    for full_name, score in rating_data.items():
-        surname = full_name.split()[0]
-        surname_scores[surname] = score
-    
-    sorted_data = sorted(surname_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # Формируем сообщение 
-    text = f"📊 <b>Рейтинг по ЯП:</b>\n\n"
-    for rank, (surname, score) in enumerate(sorted_data, start=1):
-        medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"{rank}."
-        text += f"{medal} <b>{surname}</b> — {score:.2f} лаб\n"
-    
-    keyboard = [[InlineKeyboardButton("← Назад", callback_data='back_to_menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    page = min(max(page, 0), len(rendered.pages) - 1)
+    text = rendered.pages[page]
+    reply_markup = get_rating_markup(page, len(rendered.pages))
     
     if query:
-        await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+        await edit_message(query, text, parse_mode='HTML', reply_markup=reply_markup)
     else:
         await message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
\ No newline at end of file
@@ -0,0 +1,145 @@
+# views.py
+
+import logging
+from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from constants import SUBJECTS, QUEUE_PAGE_SIZE, QUEUE_TOP_SIZE, QUEUE_NEIGHBOURHOOD
+from data import queues, get_user_display_name, is_user_notified
+
+logger = logging.getLogger(__name__)
+
+# --- Готовые клавиатуры ---
+# Вариантов немного и они не меняются, поэтому создаём каждую один раз
+
+SUBJECTS_MENU_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(subject, callback_data=f'show_queue_{subject}')] for subject in SUBJECTS]
+    + [[InlineKeyboardButton("📊 Рейтинг", callback_data='show_rating')]]
+)
+
+BACK_TO_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("← Назад", callback_data='back_to_menu')]])
+
+
+@lru_cache(maxsize=None)
+def get_queue_markup(subject, is_in_queue, page=None, page_count=1, notify=False):
+    """
+    Клавиатура меню очереди: "Сдал" для стоящих в очереди, иначе "Записаться".
+    Стоящим в очереди - переключатель уведомлений, для длинной очереди - навигация по страницам.
+    page=None - окно вокруг места пользователя. Разметки кешируются и не пересоздаются.
+    """
+    if is_in_queue:
+        action = InlineKeyboardButton("Сдал", callback_data=f'passed_{subject}')
+    else:
+        action = InlineKeyboardButton("Записаться", callback_data=f'join_{subject}')
+    keyboard = []
+    if page_count > 1:
+        if page is None:
+            nav = [InlineKeyboardButton("📄 Вся очередь", callback_data=f'queue_page_{subject}_0')]
+        else:
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("◀", callback_data=f'queue_page_{subject}_{page - 1}'))
+            if is_in_queue:
+                nav.append(InlineKeyboardButton(f"📍 {page + 1}/{page_count}", callback_data=f'queue_page_{subject}_me'))
+            else:
+                nav.append(InlineKeyboardButton(f"{page + 1}/{page_count}", callback_data=f'queue_page_{subject}_{page}'))
+            if page < page_count - 1:
+                nav.append(InlineKeyboardButton("▶", callback_data=f'queue_page_{subject}_{page + 1}'))
+        keyboard.append(nav)
+    if is_in_queue:
+        label = "🔕 Выключить уведомления" if notify else "🔔 Уведомлять о сдвиге"
+        keyboard.append([InlineKeyboardButton(label, callback_data=f'notify_toggle_{subject}')])
+    keyboard.append([action, InlineKeyboardButton("← Назад", callback_data='back_to_menu')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@lru_cache(maxsize=None)
+def get_rating_markup(page, page_count):
+    """Клавиатура страницы рейтинга: листание (если страниц несколько) и "Назад"."""
+    if page_count <= 1:
+        return BACK_TO_MENU_MARKUP
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀", callback_data=f'show_rating_{page - 1}'))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{page_count}", callback_data=f'show_rating_{page}'))
+    if page < page_count - 1:
+        nav.append(InlineKeyboardButton("▶", callback_data=f'show_rating_{page + 1}'))
+    return InlineKeyboardMarkup([nav, [InlineKeyboardButton("← Назад", callback_data='back_to_menu')]])
+
+
+# --- Кеш отрисовки очередей ---
+# Предмет -> (версия очереди, {страница: текст}). Страницы пересобираются только после
+# изменения очереди; каждая строится срезом QueueStore за O(размер страницы).
+_queue_page_cache = {}
+
+
+def _render_lines(queue_slice, first_position, user_id=None):
+    lines = []
+    for position, uid in enumerate(queue_slice, start=first_position):
+        line = f"{position}. {get_user_display_name(uid)}"
+        if uid == user_id:
+            line += " ← ты"
+        lines.append(line)
+    return lines
+
+
+def get_page_count(subject):
+    return max(1, -(-len(queues[subject]) // QUEUE_PAGE_SIZE))
+
+
+def render_queue_page(subject, page):
+    """Возвращает страницу списка "N. имя", пересобирая её только при смене версии очереди."""
+    queue = queues[subject]
+    cached = _queue_page_cache.get(subject)
+    if cached is None or cached[0] != queue.version:
+        cached = _queue_page_cache[subject] = (queue.version, {})
+    pages = cached[1]
+    if page not in pages:
+        start = page * QUEUE_PAGE_SIZE
+        body = "\n".join(_render_lines(queue.slice(start, start + QUEUE_PAGE_SIZE), start + 1))
+        pages[page] = body or "Очередь пуста"
+        logger.debug(f"Страница {page} очереди '{subject}' отрисована (версия {queue.version}).")
+    return pages[page]
+
+
+def render_queue_window(subject, user_id):
+    """
+    Окно вокруг пользователя: первые QUEUE_TOP_SIZE мест, "…" и соседи пользователя.
+    Строится за O(QUEUE_TOP_SIZE + QUEUE_NEIGHBOURHOOD), независимо от длины очереди.
+    """
+    queue = queues[subject]
+    index = queue.index(user_id)
+    window_start = max(0, index - QUEUE_NEIGHBOURHOOD)
+    window_stop = index + QUEUE_NEIGHBOURHOOD + 1
+    if window_start <= QUEUE_TOP_SIZE:
+        lines = _render_lines(queue.slice(0, window_stop), 1, user_id)
+    else:
+        lines = _render_lines(queue.slice(0, QUEUE_TOP_SIZE), 1, user_id)
+        lines.append("…")
+        lines.extend(_render_lines(queue.slice(window_start, window_stop), window_start + 1, user_id))
+    if window_stop < len(queue):
+        lines.append("…")
+    return "\n".join(lines)
+
+
+def build_queue_view(subject, user_id, page=None):
+    """
+    Текст и клавиатура меню очереди для пользователя.
+    page=None: короткая очередь целиком, для длинной - окно вокруг пользователя
+    (или первая страница, если он не в очереди).
+    """
+    queue = queues[subject]
+    is_in_queue = user_id in queue
+    page_count = get_page_count(subject)
+
+    if page is None and page_count > 1 and is_in_queue:
+        body = render_queue_window(subject, user_id)
+    else:
+        page = min(max(page or 0, 0), page_count - 1)
+        body = render_queue_page(subject, page)
+        if page_count > 1:
+            body += f"\n\nСтраница {page + 1} из {page_count}, всего {len(queue)}"
+
+    text = f"Очередь по '{subject}':\n{body}"
+    if is_in_queue:
+        text += f"\n\nТвоё место: {queue.index(user_id) + 1}"
+    return text, get_queue_markup(subject, is_in_queue, page, page_count, is_user_notified(user_id))